@@ -1,14 +1,38 @@
 from pydantic import BaseModel
+from typing import Literal
 import json
-from dotenv import load_dotenv
+import time
+import random
+import os
+from env import load_env
 from datetime import datetime
-from market import get_share_price
-from database import write_account, read_account, write_log
+from market import get_share_price, get_share_prices
+from database import (
+    transaction,
+    write_account,
+    read_account,
+    read_transactions,
+    count_transactions,
+    read_portfolio_value_time_series,
+    read_latest_portfolio_snapshot,
+    replace_account,
+    record_transactions,
+    write_portfolio_snapshot,
+    write_log,
+    ConcurrentUpdateError,
+)
 
-load_dotenv(override=True)
+load_env()
 
 INITIAL_BALANCE = 10_000.0
 SPREAD = 0.002
+SCALAR_FIELDS = {"name", "balance", "strategy"}
+MAX_RETRIES = 3
+SNAPSHOT_MIN_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_MIN_INTERVAL_SECONDS", "60"))
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# The compact report shows this many recent transactions, with rationales cut to this many characters
+SUMMARY_TRANSACTIONS = int(os.getenv("SUMMARY_TRANSACTIONS", "10"))
+SUMMARY_RATIONALE_CHARS = 120
 
 
 class Transaction(BaseModel):
@@ -25,13 +49,42 @@ class Transaction(BaseModel):
         return f"{abs(self.quantity)} shares of {self.symbol} at {self.price} each."
 
 
+class Order(BaseModel):
+    symbol: str
+    side: Literal["buy", "sell"]
+    quantity: int
+    rationale: str
+
+
+class Position(BaseModel):
+    """ Running totals for one symbol, using the average cost method. """
+    quantity: int = 0
+    cost_basis: float = 0.0
+    realized_pnl: float = 0.0
+
+    def average_price(self) -> float:
+        return self.cost_basis / self.quantity if self.quantity else 0.0
+
+    def apply(self, quantity: int, price: float):
+        """ Update the position for a buy (positive quantity) or sell (negative quantity) in O(1). """
+        if quantity > 0:
+            self.cost_basis += quantity * price
+        elif self.quantity:
+            average_price = self.average_price()
+            self.realized_pnl += -quantity * (price - average_price)
+            self.cost_basis = self.cost_basis + quantity * average_price if self.quantity + quantity else 0.0
+        self.quantity += quantity
+
+
 class Account(BaseModel):
     name: str
     balance: float
     strategy: str
     holdings: dict[str, int]
-    transactions: list[Transaction]
-    portfolio_value_time_series: list[tuple[str, float]]
+    positions: dict[str, Position] = {}
+    version: int = 0
+    _report: tuple | None = None
+    _summary: tuple | None = None
 
     @classmethod
     def get(cls, name: str):
@@ -42,63 +95,107 @@ class Account(BaseModel):
                 "balance": INITIAL_BALANCE,
                 "strategy": "",
                 "holdings": {},
-                "transactions": [],
-                "portfolio_value_time_series": []
+                "positions": {},
             }
-            write_account(name, fields)
+            fields["version"] = replace_account(name, fields)
         return cls(**fields)
     
     
     def save(self):
-        write_account(self.name.lower(), self.model_dump())
+        """ Persist the scalar fields; the ledger is appended to by each trade. """
+        self.version = write_account(self.name.lower(), self.model_dump(include=SCALAR_FIELDS), self.version)
+
+    def refresh(self):
+        """ Reload this account's state from the DB in place. """
+        fresh = Account.get(self.name)
+        for field in type(self).model_fields:
+            setattr(self, field, getattr(fresh, field))
+
+    def mutate(self, apply):
+        """
+        Run apply(), which validates against and changes this account and then saves it, as an optimistic
+        transaction: if another process wrote the account first, reload it and run apply() again.
+        If it keeps losing the race, take the write lock before reloading so the last attempt can't conflict.
+        """
+        for attempt in range(MAX_RETRIES):
+            try:
+                return apply()
+            except ConcurrentUpdateError:
+                self.refresh()
+                time.sleep(random.uniform(0, 0.005 * 2**attempt))
+        with transaction():
+            self.refresh()
+            return apply()
+
+    def record(self, *transactions: Transaction):
+        """ Apply transactions to holdings and positions, then persist them with the new balance in one DB transaction. """
+        for transaction in transactions:
+            position = self.positions.setdefault(transaction.symbol, Position())
+            position.apply(transaction.quantity, transaction.price)
+            if position.quantity:
+                self.holdings[transaction.symbol] = position.quantity
+            else:
+                self.holdings.pop(transaction.symbol, None)
+        symbols = {transaction.symbol for transaction in transactions}
+        self.version = record_transactions(
+            self.name,
+            self.model_dump(include=SCALAR_FIELDS),
+            [transaction.model_dump() for transaction in transactions],
+            {symbol: self.positions[symbol].model_dump() for symbol in symbols},
+            self.version,
+        )
 
     def reset(self, strategy: str):
         self.balance = INITIAL_BALANCE
         self.strategy = strategy
         self.holdings = {}
-        self.transactions = []
-        self.portfolio_value_time_series = []
-        self.save()
+        self.positions = {}
+        self.version = replace_account(self.name, self.model_dump())
 
     def deposit(self, amount: float):
         """ Deposit funds into the account. """
         if amount <= 0:
             raise ValueError("Deposit amount must be positive.")
-        self.balance += amount
+
+        def apply():
+            self.balance += amount
+            self.save()
+
+        self.mutate(apply)
         print(f"Deposited ${amount}. New balance: ${self.balance}")
-        self.save()
 
     def withdraw(self, amount: float):
         """ Withdraw funds from the account, ensuring it doesn't go negative. """
-        if amount > self.balance:
-            raise ValueError("Insufficient funds for withdrawal.")
-        self.balance -= amount
+        def apply():
+            if amount > self.balance:
+                raise ValueError("Insufficient funds for withdrawal.")
+            self.balance -= amount
+            self.save()
+
+        self.mutate(apply)
         print(f"Withdrew ${amount}. New balance: ${self.balance}")
-        self.save()
 
     def buy_shares(self, symbol: str, quantity: int, rationale: str) -> str:
         """ Buy shares of a stock if sufficient funds are available. """
         price = get_share_price(symbol)
         buy_price = price * (1 + SPREAD)
         total_cost = buy_price * quantity
-        
-        if total_cost > self.balance:
-            raise ValueError("Insufficient funds to buy shares.")
-        elif price==0:
-            raise ValueError(f"Unrecognized symbol {symbol}")
-        
-        # Update holdings
-        self.holdings[symbol] = self.holdings.get(symbol, 0) + quantity
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
         # Record transaction
         transaction = Transaction(symbol=symbol, quantity=quantity, price=buy_price, timestamp=timestamp, rationale=rationale)
-        self.transactions.append(transaction)
-        
-        # Update balance
-        self.balance -= total_cost
-        self.save()
+
+        def apply():
+            if total_cost > self.balance:
+                raise ValueError("Insufficient funds to buy shares.")
+            elif price==0:
+                raise ValueError(f"Unrecognized symbol {symbol}")
+            # Update balance, holdings and position
+            self.balance -= total_cost
+            self.record(transaction)
+
+        self.mutate(apply)
         write_log(self.name, "account", f"Bought {quantity} of {symbol}")
-        return "Completed. Latest details:\n" + self.report()
+        return "Completed. Latest details:\n" + self.summary()
 
     def sell_shares(self, symbol: str, quantity: int, rationale: str) -> str:
         """ Sell shares of a stock if the user has enough shares. """
@@ -109,34 +206,124 @@ class Account(BaseModel):
         sell_price = price * (1 - SPREAD)
         total_proceeds = sell_price * quantity
         
-        # Update holdings
-        self.holdings[symbol] -= quantity
-        
-        # If shares are completely sold, remove from holdings
-        if self.holdings[symbol] == 0:
-            del self.holdings[symbol]
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
         # Record transaction
         transaction = Transaction(symbol=symbol, quantity=-quantity, price=sell_price, timestamp=timestamp, rationale=rationale)  # negative quantity for sell
-        self.transactions.append(transaction)
 
-        # Update balance
-        self.balance += total_proceeds
-        self.save()
+        def apply():
+            if self.holdings.get(symbol, 0) < quantity:
+                raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
+            # Update balance, holdings and position
+            self.balance += total_proceeds
+            self.record(transaction)
+
+        self.mutate(apply)
         write_log(self.name, "account", f"Sold {quantity} of {symbol}")
-        return "Completed. Latest details:\n" + self.report()
+        return "Completed. Latest details:\n" + self.summary()
+
+    def execute_orders(self, orders: list[Order]) -> str:
+        """
+        Execute several orders as one: price every symbol in a single lookup, check cash and holdings for the
+        whole batch up front, then record all the trades in one DB transaction. Sales are applied before
+        purchases, so their proceeds can fund the purchases. If any order can't be filled, none are.
+        """
+        if not orders:
+            raise ValueError("No orders given.")
+        if any(order.quantity <= 0 for order in orders):
+            raise ValueError("Order quantities must be positive.")
+        prices = get_share_prices(order.symbol for order in orders)
+        unrecognized = sorted({symbol for symbol, price in prices.items() if price == 0})
+        if unrecognized:
+            raise ValueError(f"Unrecognized symbols {', '.join(unrecognized)}")
+
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        transactions = []
+        for order in sorted(orders, key=lambda order: order.side != "sell"):
+            if order.side == "sell":
+                price, quantity = prices[order.symbol] * (1 - SPREAD), -order.quantity
+            else:
+                price, quantity = prices[order.symbol] * (1 + SPREAD), order.quantity
+            transactions.append(
+                Transaction(symbol=order.symbol, quantity=quantity, price=price, timestamp=timestamp, rationale=order.rationale)
+            )
+
+        def apply():
+            selling = {}
+            for transaction in transactions:
+                if transaction.quantity < 0:
+                    selling[transaction.symbol] = selling.get(transaction.symbol, 0) - transaction.quantity
+            for symbol, quantity in selling.items():
+                if self.holdings.get(symbol, 0) < quantity:
+                    raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
+            balance = self.balance - sum(transaction.total() for transaction in transactions)
+            if balance < 0:
+                raise ValueError("Insufficient funds to execute these orders.")
+            self.balance = balance
+            self.record(*transactions)
 
-    def calculate_portfolio_value(self):
+        self.mutate(apply)
+        summary = "; ".join(
+            f"{'Bought' if t.quantity > 0 else 'Sold'} {abs(t.quantity)} of {t.symbol} at {t.price:.2f}" for t in transactions
+        )
+        write_log(self.name, "account", summary)
+        portfolio_value = self.calculate_portfolio_value()
+        return json.dumps({
+            "executed": summary,
+            "balance": self.balance,
+            "holdings": self.holdings,
+            "total_portfolio_value": portfolio_value,
+            "total_profit_loss": self.calculate_profit_loss(portfolio_value),
+        })
+
+    def calculate_portfolio_value(self, prices: dict[str, float] | None = None):
         """ Calculate the total value of the user's portfolio. """
-        total_value = self.balance
-        for symbol, quantity in self.holdings.items():
-            total_value += get_share_price(symbol) * quantity
-        return total_value
+        prices = prices if prices is not None else get_share_prices(self.holdings)
+        return self.balance + sum(prices[symbol] * quantity for symbol, quantity in self.holdings.items())
 
     def calculate_profit_loss(self, portfolio_value: float):
         """ Calculate profit or loss from the initial spend. """
-        initial_spend = sum(transaction.total() for transaction in self.transactions)
-        return portfolio_value - initial_spend - self.balance
+        # Net spend on shares is the cost basis still held less the gains already realized
+        net_spend = sum(position.cost_basis - position.realized_pnl for position in self.positions.values())
+        return portfolio_value - net_spend - self.balance
+
+    def calculate_realized_profit_loss(self) -> float:
+        """ Calculate the profit or loss locked in by sales. """
+        return sum(position.realized_pnl for position in self.positions.values())
+
+    def calculate_unrealized_profit_loss(self) -> float:
+        """ Calculate the profit or loss on shares still held, at current prices. """
+        return sum(entry["unrealized_pnl"] for entry in self.get_position_breakdown().values())
+
+    def get_position_breakdown(self, prices: dict[str, float] | None = None) -> dict[str, dict]:
+        """ Report quantity, average price, cost basis, market value and P&L for each symbol traded. """
+        breakdown = {}
+        prices = prices if prices is not None else get_share_prices(self.holdings)
+        for symbol, position in self.positions.items():
+            market_value = prices[symbol] * position.quantity if position.quantity else 0.0
+            breakdown[symbol] = {
+                "quantity": position.quantity,
+                "average_price": position.average_price(),
+                "cost_basis": position.cost_basis,
+                "market_value": market_value,
+                "unrealized_pnl": market_value - position.cost_basis,
+                "realized_pnl": position.realized_pnl,
+            }
+        return breakdown
+
+    def check_consistency(self, tolerance: float = 1e-6) -> list[str]:
+        """ Recompute positions from the full ledger and report any that disagree with the running totals. """
+        expected: dict[str, Position] = {}
+        for transaction in read_transactions(self.name):
+            expected.setdefault(transaction["symbol"], Position()).apply(transaction["quantity"], transaction["price"])
+        problems = []
+        for symbol in sorted(expected.keys() | self.positions.keys()):
+            want, have = expected.get(symbol, Position()), self.positions.get(symbol, Position())
+            for field in ("quantity", "cost_basis", "realized_pnl"):
+                if abs(getattr(want, field) - getattr(have, field)) > tolerance:
+                    problems.append(f"{symbol} {field}: ledger says {getattr(want, field)}, account has {getattr(have, field)}")
+            if want.quantity != self.holdings.get(symbol, 0):
+                problems.append(f"{symbol} holdings: ledger says {want.quantity}, account has {self.holdings.get(symbol, 0)}")
+        return problems
 
     def get_holdings(self):
         """ Report the current holdings of the user. """
@@ -144,33 +331,98 @@ class Account(BaseModel):
 
     def get_profit_loss(self):
         """ Report the user's profit or loss at any point in time. """
-        return self.calculate_profit_loss()
+        return self.calculate_profit_loss(self.calculate_portfolio_value())
+
+    def list_transactions(self, limit: int | None = None, offset: int = 0):
+        """ List the transactions made by the user, oldest first; with a limit, just a page of the most recent. """
+        return read_transactions(self.name, limit, offset)
 
-    def list_transactions(self):
-        """ List all transactions made by the user. """
-        return [transaction.model_dump() for transaction in self.transactions]
+    def get_portfolio_value_time_series(self) -> list[tuple[str, float]]:
+        """ Return the recorded (datetime, portfolio value) snapshots, oldest first. """
+        return read_portfolio_value_time_series(self.name)
     
     def report(self) -> str:
-        """ Return a json string representing the account.  """
-        portfolio_value = self.calculate_portfolio_value()
-        self.portfolio_value_time_series.append((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), portfolio_value))
-        self.save()
-        pnl = self.calculate_profit_loss(portfolio_value)
-        data = self.model_dump()
-        data["total_portfolio_value"] = portfolio_value
-        data["total_profit_loss"] = pnl
-        write_log(self.name, "account", f"Retrieved account details")
-        return json.dumps(data)
+        """
+        Return a json string representing the account. This only reads: it's rebuilt when the account's version,
+        the prices of its holdings or its latest snapshot change, and otherwise served from the last build.
+        """
+        prices = get_share_prices(self.holdings)
+        latest = read_latest_portfolio_snapshot(self.name)
+        key = (self.version, tuple(sorted(prices.items())), latest[0] if latest else None)
+        if self._report is None or self._report[0] != key:
+            portfolio_value = self.calculate_portfolio_value(prices)
+            data = self.model_dump(exclude={"version"})
+            data["transactions"] = self.list_transactions()
+            data["portfolio_value_time_series"] = self.get_portfolio_value_time_series()
+            data["total_portfolio_value"] = portfolio_value
+            data["total_profit_loss"] = self.calculate_profit_loss(portfolio_value)
+            self._report = (key, json.dumps(data))
+        return self._report[1]
+
+    def summary(self, recent: int = SUMMARY_TRANSACTIONS) -> str:
+        """
+        Return a compact json report for prompts, whose size doesn't grow with the account's history: open
+        positions with their P&L, totals, and only the most recent transactions. Cached like report().
+        """
+        prices = get_share_prices(self.holdings)
+        key = (self.version, tuple(sorted(prices.items())), recent)
+        if self._summary is None or self._summary[0] != key:
+            portfolio_value = self.calculate_portfolio_value(prices)
+            breakdown = self.get_position_breakdown(prices)
+            positions = {
+                symbol: {
+                    "quantity": entry["quantity"],
+                    "average_price": round(entry["average_price"], 2),
+                    "price": prices[symbol],
+                    "market_value": round(entry["market_value"], 2),
+                    "unrealized_pnl": round(entry["unrealized_pnl"], 2),
+                    "realized_pnl": round(entry["realized_pnl"], 2),
+                }
+                for symbol, entry in breakdown.items() if entry["quantity"]
+            }
+            transactions = self.list_transactions(limit=recent)
+            for transaction in transactions:
+                transaction["price"] = round(transaction["price"], 2)
+                if len(transaction["rationale"]) > SUMMARY_RATIONALE_CHARS:
+                    transaction["rationale"] = transaction["rationale"][:SUMMARY_RATIONALE_CHARS - 3] + "..."
+            data = {
+                "name": self.name,
+                "strategy": self.strategy,
+                "balance": round(self.balance, 2),
+                "positions": positions,
+                "total_portfolio_value": round(portfolio_value, 2),
+                "total_profit_loss": round(self.calculate_profit_loss(portfolio_value), 2),
+                "realized_profit_loss": round(sum(entry["realized_pnl"] for entry in breakdown.values()), 2),
+                "unrealized_profit_loss": round(sum(entry["unrealized_pnl"] for entry in breakdown.values()), 2),
+                "transaction_count": count_transactions(self.name),
+                "recent_transactions": transactions,
+            }
+            self._summary = (key, json.dumps(data))
+        return self._summary[1]
+
+    def snapshot(self, min_interval: float = SNAPSHOT_MIN_INTERVAL_SECONDS) -> bool:
+        """
+        Record the current portfolio value in the time series, unless the last snapshot is under min_interval
+        seconds old. Returns whether a snapshot was written.
+        """
+        now = datetime.now()
+        latest = read_latest_portfolio_snapshot(self.name)
+        if latest and (now - datetime.strptime(latest[1], TIMESTAMP_FORMAT)).total_seconds() < min_interval:
+            return False
+        write_portfolio_snapshot(self.name, now.strftime(TIMESTAMP_FORMAT), self.calculate_portfolio_value())
+        return True
     
     def get_strategy(self) -> str:
         """ Return the strategy of the account """
-        write_log(self.name, "account", f"Retrieved strategy")
         return self.strategy
     
     def change_strategy(self, strategy: str) -> str:
         """ At your discretion, if you choose to, call this to change your investment strategy for the future """
-        self.strategy = strategy
-        self.save()
+        def apply():
+            self.strategy = strategy
+            self.save()
+
+        self.mutate(apply)
         write_log(self.name, "account", f"Changed strategy")
         return "Changed strategy"
 
@@ -1,50 +1,186 @@
 import mcp
-from mcp.client.stdio import stdio_client
-from mcp import StdioServerParameters
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
 from agents import FunctionTool
+from agents.strict_schema import ensure_strict_json_schema
+from mcp_params import local_server_params
+from mcp_transports import open_client_session
+import anyio
+import asyncio
+import copy
 import json
+import os
+import time
 
-params = StdioServerParameters(command="uv", args=["run", "accounts_server.py"], env=None)
+# The accounts server over whichever transport MCP_TRANSPORT selects, like the traders' own connection to it
+params = local_server_params("accounts_server")
+
+SESSION_IDLE_TIMEOUT = float(os.getenv("MCP_SESSION_IDLE_TIMEOUT", "300"))
+SESSION_REQUEST_TIMEOUT = float(os.getenv("MCP_SESSION_REQUEST_TIMEOUT", "120"))
+
+# Errors meaning the server process or its pipes went away, rather than the request itself failing
+CONNECTION_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, ConnectionError, OSError)
+
+
+class PooledSession:
+    """
+    One initialized ClientSession for a server, owned by a background task so the transport and session
+    contexts are entered and exited in the same task. The session closes itself once it has gone unused
+    for the idle timeout; the next request starts a fresh one.
+    """
+
+    def __init__(self, server_params: dict, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.server_params = server_params
+        self.idle_timeout = idle_timeout
+        self.refs = 0
+        self.connects = 0
+        self.last_used = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._ready: asyncio.Future | None = None
+        self._stop = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> mcp.ClientSession:
+        async with self._lock:
+            if self._task is None or self._task.done():
+                self.connects += 1
+                self._stop = asyncio.Event()
+                self._ready = asyncio.get_running_loop().create_future()
+                self._task = asyncio.create_task(self._run(self._ready, self._stop))
+            ready = self._ready
+        return await asyncio.shield(ready)
+
+    async def _run(self, ready: asyncio.Future, stop: asyncio.Event) -> None:
+        try:
+            async with open_client_session(self.server_params, SESSION_REQUEST_TIMEOUT) as session:
+                ready.set_result(session)
+                while not stop.is_set():
+                    try:
+                        await asyncio.wait_for(stop.wait(), self.idle_timeout)
+                    except asyncio.TimeoutError:
+                        if self.refs == 0 and time.monotonic() - self.last_used >= self.idle_timeout:
+                            break
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            if not ready.done():
+                ready.set_exception(ConnectionError(f"MCP session for {self.server_params} closed"))
+
+    async def close(self) -> None:
+        task = self._task
+        if task is not None and not task.done():
+            self._stop.set()
+            await asyncio.wait([task], timeout=5)
+            if not task.done():
+                task.cancel()
+
+
+class SessionPool:
+    """
+    Long-lived MCP client sessions, one per set of server parameters, shared by every caller in this
+    event loop. ClientSession matches responses to requests by id, so concurrent callers simply
+    multiplex over the one session. A read that fails because the server went away is retried once
+    on a fresh session; a tool call isn't, since it may have traded before the connection dropped.
+    """
+
+    def __init__(self, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions: dict[str, PooledSession] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.stats = {"requests": 0, "reconnects": 0}
+
+    def _entry(self, server_params: dict) -> PooledSession:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Sessions belong to the loop that started them; a new loop starts over
+            self._sessions, self._loop = {}, loop
+        key = json.dumps(server_params, sort_keys=True)
+        if key not in self._sessions:
+            self._sessions[key] = PooledSession(server_params, self.idle_timeout)
+        return self._sessions[key]
+
+    async def request(self, server_params: dict, send, idempotent: bool = True):
+        """
+        Run send(session), an async function making requests on the server's pooled session. Only an
+        idempotent send is retried if the connection drops; otherwise the error goes to the caller.
+        """
+        entry = self._entry(server_params)
+        self.stats["requests"] += 1
+        for attempt in range(2):
+            entry.refs += 1
+            try:
+                return await send(await entry.get())
+            except (McpError, *CONNECTION_ERRORS) as e:
+                if isinstance(e, McpError) and e.error.code != CONNECTION_CLOSED:
+                    raise
+                # The session is broken either way, so the next request starts a fresh one
+                await entry.close()
+                if attempt or not idempotent:
+                    raise
+                self.stats["reconnects"] += 1
+            finally:
+                entry.refs -= 1
+                entry.last_used = time.monotonic()
+
+    async def close(self) -> None:
+        sessions, self._sessions = list(self._sessions.values()), {}
+        await asyncio.gather(*(session.close() for session in sessions))
+
+
+pool = SessionPool()
 
 
 async def list_accounts_tools():
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            tools_result = await session.list_tools()
-            return tools_result.tools
-        
+    tools_result = await pool.request(params, lambda session: session.list_tools())
+    return tools_result.tools
+
 async def call_accounts_tool(tool_name, tool_args):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.call_tool(tool_name, tool_args)
-            return result
-            
+    return await pool.request(params, lambda session: session.call_tool(tool_name, tool_args), idempotent=False)
+
 async def read_accounts_resource(name):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.read_resource(f"accounts://accounts_server/{name}")
-            return result.contents[0].text
-        
+    result = await pool.request(params, lambda session: session.read_resource(f"accounts://accounts_server/{name}"))
+    return result.contents[0].text
+
+async def read_account_summary_resource(name):
+    result = await pool.request(params, lambda session: session.read_resource(f"accounts://summary/{name}"))
+    return result.contents[0].text
+
 async def read_strategy_resource(name):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.read_resource(f"accounts://strategy/{name}")
-            return result.contents[0].text
+    result = await pool.request(params, lambda session: session.read_resource(f"accounts://strategy/{name}"))
+    return result.contents[0].text
+
+async def close_accounts_sessions():
+    await pool.close()
+
+def strict_tool_schema(schema: dict) -> tuple[dict, bool]:
+    """
+    The tool's input schema in OpenAI's strict form, closing nested objects such as the $defs too, and whether
+    that worked; like the agents SDK's own MCP tools, a schema that can't be made strict is used as it is.
+    """
+    schema = copy.deepcopy(schema)
+    schema.setdefault("properties", {})
+    try:
+        schema = ensure_strict_json_schema(schema)
+    except Exception:
+        return schema, False
+    # Strict mode makes every parameter required and has no defaults, so the model passes optional ones explicitly
+    # (the tool descriptions give their usual values)
+    for definition in [schema, *schema.get("$defs", {}).values()]:
+        for property in definition.get("properties", {}).values():
+            property.pop("default", None)
+    return schema, True
 
 async def get_accounts_tools_openai():
     openai_tools = []
     for tool in await list_accounts_tools():
-        schema = {**tool.inputSchema, "additionalProperties": False}
+        schema, strict = strict_tool_schema(tool.inputSchema)
         openai_tool = FunctionTool(
             name=tool.name,
-            description=tool.description,
+            description=tool.description or "",
             params_json_schema=schema,
-            on_invoke_tool=lambda ctx, args, toolname=tool.name: call_accounts_tool(toolname, json.loads(args))
-                
+            on_invoke_tool=lambda ctx, args, toolname=tool.name: call_accounts_tool(toolname, json.loads(args)),
+            strict_json_schema=strict,
         )
         openai_tools.append(openai_tool)
-    return openai_tools
\ No newline at end of file
+    return openai_tools
@@ -1,5 +1,61 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
 from mcp.server.fastmcp import FastMCP
-from accounts import Account
+from accounts import Account, Order
+from database import read_account_version, checkpoint
+
+# Reads are served from Account objects kept in memory. Each one remembers the version it was loaded at, and a
+# one-row version check picks up writes made by other processes at most ACCOUNT_CACHE_MAX_STALENESS seconds late.
+# Mutations always revalidate first and are written through to the DB by the Account itself.
+ACCOUNT_CACHE_MAX_STALENESS = float(os.getenv("ACCOUNT_CACHE_MAX_STALENESS", "1.0"))
+
+
+class AccountCache:
+    def __init__(self, max_staleness: float = ACCOUNT_CACHE_MAX_STALENESS):
+        self.max_staleness = max_staleness
+        self._entries: dict[str, tuple[Account, float]] = {}
+        # Served in-process, tools run concurrently in worker threads, so mutations of one account take turns
+        self._locks: dict[str, threading.Lock] = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, name: str, max_staleness: float | None = None) -> Account:
+        name = name.lower()
+        max_staleness = self.max_staleness if max_staleness is None else max_staleness
+        now = time.monotonic()
+        entry = self._entries.get(name)
+        if entry:
+            account, checked_at = entry
+            if now - checked_at <= max_staleness:
+                self.stats["hits"] += 1
+                return account
+            if read_account_version(name) == account.version:
+                self._entries[name] = (account, now)
+                self.stats["hits"] += 1
+                return account
+        self.stats["misses"] += 1
+        account = Account.get(name)
+        self._entries[name] = (account, now)
+        return account
+
+    @contextmanager
+    def update(self, name: str):
+        """Yield an up to date Account to mutate; if the mutation fails part way, the cached copy is dropped."""
+        with self._locks.setdefault(name.lower(), threading.Lock()):
+            account = self.get(name, max_staleness=0)
+            try:
+                yield account
+            except Exception:
+                self.invalidate(name)
+                raise
+
+    def invalidate(self, name: str) -> None:
+        self._entries.pop(name.lower(), None)
+
+
+accounts = AccountCache()
 
 mcp = FastMCP("accounts_server")
 
@@ -10,7 +66,7 @@ async def get_balance(name: str) -> float:
     Args:
         name: The name of the account holder
     """
-    return Account.get(name).balance
+    return accounts.get(name).balance
 
 @mcp.tool()
 async def get_holdings(name: str) -> dict[str, int]:
@@ -19,10 +75,21 @@ async def get_holdings(name: str) -> dict[str, int]:
     Args:
         name: The name of the account holder
     """
-    return Account.get(name).holdings
+    return accounts.get(name).holdings
 
 @mcp.tool()
-async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> float:
+async def list_transactions(name: str, offset: int = 0, limit: int = 20) -> list[dict]:
+    """Page back through the account's transaction history, beyond the recent transactions in its summary.
+
+    Args:
+        name: The name of the account holder
+        offset: How many of the most recent transactions to skip
+        limit: How many transactions to return, at most 100
+    """
+    return accounts.get(name).list_transactions(limit=min(max(limit, 1), 100), offset=max(offset, 0))
+
+@mcp.tool()
+async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> str:
     """Buy shares of a stock.
 
     Args:
@@ -31,11 +98,12 @@ async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> f
         quantity: The quantity of shares to buy
         rationale: The rationale for the purchase and fit with the account's strategy
     """
-    return Account.get(name).buy_shares(symbol, quantity, rationale)
+    with accounts.update(name) as account:
+        return account.buy_shares(symbol, quantity, rationale)
 
 
 @mcp.tool()
-async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) -> float:
+async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) -> str:
     """Sell shares of a stock.
 
     Args:
@@ -44,7 +112,22 @@ async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) ->
         quantity: The quantity of shares to sell
         rationale: The rationale for the sale and fit with the account's strategy
     """
-    return Account.get(name).sell_shares(symbol, quantity, rationale)
+    with accounts.update(name) as account:
+        return account.sell_shares(symbol, quantity, rationale)
+
+@mcp.tool()
+async def execute_orders(name: str, orders: list[Order]) -> str:
+    """Execute several buy and sell orders together, e.g. to rebalance a portfolio in one step.
+    All symbols are priced at once, sales are applied before purchases so their proceeds can fund them,
+    and the orders are all or nothing: if any one can't be filled, none are.
+
+    Args:
+        name: The name of the account holder
+        orders: The orders, each with a symbol, a side ("buy" or "sell"), a positive quantity of shares
+            and a rationale for the trade and its fit with the account's strategy
+    """
+    with accounts.update(name) as account:
+        return account.execute_orders(orders)
 
 @mcp.tool()
 async def change_strategy(name: str, strategy: str) -> str:
@@ -54,17 +137,29 @@ async def change_strategy(name: str, strategy: str) -> str:
         name: The name of the account holder
         strategy: The new strategy for the account
     """
-    return Account.get(name).change_strategy(strategy)
+    with accounts.update(name) as account:
+        return account.change_strategy(strategy)
 
 @mcp.resource("accounts://accounts_server/{name}")
 async def read_account_resource(name: str) -> str:
-    account = Account.get(name.lower())
+    account = accounts.get(name, max_staleness=0)
     return account.report()
 
+@mcp.resource("accounts://summary/{name}")
+async def read_account_summary_resource(name: str) -> str:
+    account = accounts.get(name, max_staleness=0)
+    return account.summary()
+
 @mcp.resource("accounts://strategy/{name}")
 async def read_strategy_resource(name: str) -> str:
-    account = Account.get(name.lower())
+    account = accounts.get(name)
     return account.get_strategy()
 
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
\ No newline at end of file
+    # Optional arguments: a transport ("stdio", "streamable-http" or "sse") and, for HTTP, a port
+    if len(sys.argv) > 2:
+        mcp.settings.port = int(sys.argv[2])
+    try:
+        mcp.run(transport=sys.argv[1] if len(sys.argv) > 1 else "stdio")
+    finally:
+        checkpoint()
\ No newline at end of file
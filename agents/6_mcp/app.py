@@ -1,10 +1,15 @@
+import time
+import threading
+from collections import deque
 import gradio as gr
 from util import css, js, Color
 import pandas as pd
 from trading_floor import names, lastnames, short_model_names
 import plotly.express as px
 from accounts import Account
-from database import read_log
+from database import read_log_since, read_account_stamp, count_transactions
+from market import get_share_prices
+from span_stats import SpanStats, COLUMNS as LATENCY_COLUMNS
 
 mapper = {
     "trace": Color.WHITE,
@@ -13,8 +18,89 @@ mapper = {
     "generation": Color.YELLOW,
     "response": Color.MAGENTA,
     "account": Color.RED,
+    "warning": Color.RED,
 }
 
+LOG_LINES = 13
+LOG_POLL_SECONDS = 0.5
+PRICE_REFRESH_SECONDS = 60
+TRANSACTIONS_PAGE_SIZE = 20
+
+
+class LogFeed:
+    """
+    The latest log lines for every trader, kept up to date by one background poller however many browser tabs
+    are open. Each poll is one indexed query per trader for rows newer than the last it saw, and a trader's HTML
+    is only re-rendered when it has new rows; views compare versions and skip the update when nothing changed.
+    """
+
+    def __init__(self, names: list[str], last_n: int = LOG_LINES, interval: float = LOG_POLL_SECONDS):
+        self.interval = interval
+        self.lines = {name: deque(maxlen=last_n) for name in names}
+        self.versions = {name: 0 for name in names}
+        self.html = {name: self.render(name) for name in names}
+        self._lock = threading.Lock()
+        self.poll()
+        threading.Thread(target=self._run, name="log-feed", daemon=True).start()
+
+    def render(self, name: str) -> str:
+        response = ""
+        for timestamp, type, message in self.lines[name]:
+            color = mapper.get(type, Color.WHITE).value
+            response += f"<span style='color:{color}'>{timestamp[:19]} : [{type}] {message}</span><br/>"
+        return f"<div style='height:250px; overflow-y:auto;'>{response}</div>"
+
+    def poll(self) -> None:
+        for name, lines in self.lines.items():
+            rows = read_log_since(name, self.versions[name], lines.maxlen)
+            if rows:
+                # Merged by time, since the tracer's batches can arrive after lines that happened later
+                merged = sorted([*lines, *(row[1:] for row in rows)], key=lambda line: line[0])
+                lines.clear()
+                lines.extend(merged[-lines.maxlen:])
+                html = self.render(name)
+                with self._lock:
+                    self.versions[name] = max(row[0] for row in rows)
+                    self.html[name] = html
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error polling the logs: {e}")
+
+    def get(self, name: str) -> tuple[int, str]:
+        """The trader's latest log version (the id of its newest row) and rendered HTML."""
+        with self._lock:
+            return self.versions[name], self.html[name]
+
+
+class PriceBoard:
+    """
+    Prices for every trader's holdings, fetched in one batch at most once per PRICE_REFRESH_SECONDS and shared
+    by all views. The epoch only moves on when a price actually changes, so anything rendered from the prices
+    stays valid until then.
+    """
+
+    def __init__(self, interval: float = PRICE_REFRESH_SECONDS):
+        self.interval = interval
+        self.prices: dict[str, float] = {}
+        self.epoch = 0
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, symbols) -> tuple[int, dict[str, float]]:
+        """The current price epoch and the prices of these symbols."""
+        with self._lock:
+            if not self.prices.keys() >= set(symbols) or time.monotonic() - self.fetched_at > self.interval:
+                prices = get_share_prices(list(self.prices.keys() | set(symbols)))
+                if prices != self.prices:
+                    self.epoch += 1
+                self.prices, self.fetched_at = prices, time.monotonic()
+            return self.epoch, {symbol: self.prices[symbol] for symbol in symbols}
+
 
 class Trader:
     def __init__(self, name: str, lastname: str, model_name: str):
@@ -22,9 +108,22 @@ class Trader:
         self.lastname = lastname
         self.model_name = model_name
         self.account = Account.get(name)
+        self._rendered: dict[str, tuple] = {}
+
+    def reload(self) -> tuple[int, int | None]:
+        """Reload the account only if it changed, and return its (version, latest snapshot id) stamp."""
+        stamp = read_account_stamp(self.name)
+        if stamp is None or stamp[0] != self.account.version:
+            self.account = Account.get(self.name)
+            stamp = read_account_stamp(self.name)
+        return stamp
 
-    def reload(self):
-        self.account = Account.get(self.name)
+    def rendered(self, artifact: str, key, render):
+        """The artifact as last rendered, rendering it again only if its key has changed since."""
+        cached = self._rendered.get(artifact)
+        if cached is None or cached[0] != key:
+            cached = self._rendered[artifact] = (key, render())
+        return cached[1]
 
     def get_title(self) -> str:
         return f"<div style='text-align: center;font-size:34px;'>{self.name}<span style='color:#ccc;font-size:24px;'> ({self.model_name}) - {self.lastname}</span></div>"
@@ -33,7 +132,7 @@ class Trader:
         return self.account.get_strategy()
 
     def get_portfolio_value_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(self.account.portfolio_value_time_series, columns=["datetime", "value"])
+        df = pd.DataFrame(self.account.get_portfolio_value_time_series(), columns=["datetime", "value"])
         df["datetime"] = pd.to_datetime(df["datetime"])
         return df
 
@@ -64,33 +163,32 @@ class Trader:
         )
         return df
 
-    def get_transactions_df(self) -> pd.DataFrame:
-        """Convert transactions to DataFrame for display"""
-        transactions = self.account.list_transactions()
+    def transaction_pages(self) -> int:
+        return max(1, -(-count_transactions(self.name) // TRANSACTIONS_PAGE_SIZE))
+
+    def get_transactions_df(self, page: int = 1) -> pd.DataFrame:
+        """Convert a page of transactions, newest first, to DataFrame for display"""
+        offset = (page - 1) * TRANSACTIONS_PAGE_SIZE
+        transactions = self.account.list_transactions(TRANSACTIONS_PAGE_SIZE, offset)[::-1]
         if not transactions:
             return pd.DataFrame(columns=["Timestamp", "Symbol", "Quantity", "Price", "Rationale"])
 
         return pd.DataFrame(transactions)
 
-    def get_portfolio_value(self) -> str:
+    def get_portfolio_value(self, prices: dict[str, float] | None = None) -> str:
         """Calculate total portfolio value based on current prices"""
-        portfolio_value = self.account.calculate_portfolio_value() or 0.0
+        portfolio_value = self.account.calculate_portfolio_value(prices) or 0.0
         pnl = self.account.calculate_profit_loss(portfolio_value) or 0.0
         color = "green" if pnl >= 0 else "red"
         emoji = "⬆" if pnl >= 0 else "⬇"
         return f"<div style='text-align: center;background-color:{color};'><span style='font-size:32px'>${portfolio_value:,.0f}</span><span style='font-size:24px'>&nbsp;&nbsp;&nbsp;{emoji}&nbsp;${pnl:,.0f}</span></div>"
 
-    def get_logs(self, previous=None) -> str:
-        logs = read_log(self.name, last_n=13)
-        response = ""
-        for log in logs:
-            timestamp, type, message = log
-            color = mapper.get(type, Color.WHITE).value
-            response += f"<span style='color:{color}'>{timestamp} : [{type}] {message}</span><br/>"
-        response = f"<div style='height:250px; overflow-y:auto;'>{response}</div>"
-        if response != previous:
-            return response
-        return gr.update()
+    def get_logs(self, seen: int = -1):
+        """The log HTML and its version, or no update at all when this view has already seen that version."""
+        version, html = log_feed.get(self.name)
+        if version == seen:
+            return gr.update(), seen
+        return html, version
 
 
 class TraderView:
@@ -101,20 +199,43 @@ class TraderView:
         self.holdings_table = None
         self.transactions_table = None
 
+    def portfolio_value_html(self) -> str:
+        version, _ = self.trader.reload()
+        epoch, prices = price_board.get(self.trader.account.holdings)
+        return self.trader.rendered(
+            "portfolio_value", (version, epoch), lambda: self.trader.get_portfolio_value(prices)
+        )
+
+    def portfolio_value_chart(self):
+        _, snapshot = self.trader.reload()
+        return self.trader.rendered("chart", snapshot, self.trader.get_portfolio_value_chart)
+
+    def holdings_df(self) -> pd.DataFrame:
+        version, _ = self.trader.reload()
+        return self.trader.rendered("holdings", version, self.trader.get_holdings_df)
+
+    def transactions_df(self, page: int = 1) -> pd.DataFrame:
+        version, _ = self.trader.reload()
+        page = min(max(1, int(page or 1)), self.trader.transaction_pages())
+        return self.trader.rendered(
+            "transactions", (version, page), lambda: self.trader.get_transactions_df(page)
+        )
+
     def make_ui(self):
         with gr.Column():
             gr.HTML(self.trader.get_title())
             with gr.Row():
-                self.portfolio_value = gr.HTML(self.trader.get_portfolio_value)
+                self.portfolio_value = gr.HTML(self.portfolio_value_html)
             with gr.Row():
                 self.chart = gr.Plot(
-                    self.trader.get_portfolio_value_chart, container=True, show_label=False
+                    self.portfolio_value_chart, container=True, show_label=False
                 )
             with gr.Row(variant="panel"):
-                self.log = gr.HTML(self.trader.get_logs)
+                self.log = gr.HTML(log_feed.get(self.trader.name)[1])
+                self.log_version = gr.State(log_feed.get(self.trader.name)[0])
             with gr.Row():
                 self.holdings_table = gr.Dataframe(
-                    value=self.trader.get_holdings_df,
+                    value=self.holdings_df,
                     label="Holdings",
                     headers=["Symbol", "Quantity"],
                     row_count=(5, "dynamic"),
@@ -124,7 +245,7 @@ class TraderView:
                 )
             with gr.Row():
                 self.transactions_table = gr.Dataframe(
-                    value=self.trader.get_transactions_df,
+                    value=self.transactions_df,
                     label="Recent Transactions",
                     headers=["Timestamp", "Symbol", "Quantity", "Price", "Rationale"],
                     row_count=(5, "dynamic"),
@@ -132,16 +253,29 @@ class TraderView:
                     max_height=300,
                     elem_classes=["dataframe-fix"],
                 )
+            with gr.Row():
+                self.transactions_page = gr.Number(
+                    value=1, label="Transactions page (newest first)", minimum=1, precision=0
+                )
+            self.rendered_key = gr.State(None)
 
+        self.transactions_page.change(
+            fn=self.transactions_df,
+            inputs=[self.transactions_page],
+            outputs=[self.transactions_table],
+            show_progress="hidden",
+            queue=False,
+        )
         timer = gr.Timer(value=120)
         timer.tick(
             fn=self.refresh,
-            inputs=[],
+            inputs=[self.transactions_page, self.rendered_key],
             outputs=[
                 self.portfolio_value,
                 self.chart,
                 self.holdings_table,
                 self.transactions_table,
+                self.rendered_key,
             ],
             show_progress="hidden",
             queue=False,
@@ -149,22 +283,45 @@ class TraderView:
         log_timer = gr.Timer(value=0.5)
         log_timer.tick(
             fn=self.trader.get_logs,
-            inputs=[self.log],
-            outputs=[self.log],
+            inputs=[self.log_version],
+            outputs=[self.log, self.log_version],
             show_progress="hidden",
             queue=False,
         )
 
-    def refresh(self):
-        self.trader.reload()
+    def refresh(self, page: int = 1, seen=None):
+        """
+        Everything rendered is keyed by the account's version and latest snapshot and the price epoch, so an
+        unchanged trader is served from the cache, and sends nothing at all to a tab that already shows it.
+        """
+        stamp = self.trader.reload()
+        epoch, _ = price_board.get(self.trader.account.holdings)
+        key = (*stamp, epoch, page)
+        if key == seen:
+            return gr.update(), gr.update(), gr.update(), gr.update(), seen
         return (
-            self.trader.get_portfolio_value(),
-            self.trader.get_portfolio_value_chart(),
-            self.trader.get_holdings_df(),
-            self.trader.get_transactions_df(),
+            self.portfolio_value_html(),
+            self.portfolio_value_chart(),
+            self.holdings_df(),
+            self.transactions_df(page),
+            key,
         )
 
 
+log_feed = LogFeed(names)
+price_board = PriceBoard()
+
+# Latency percentiles by model, tool and MCP server, fed incrementally from the spans table
+span_stats = SpanStats()
+span_stats_lock = threading.Lock()
+
+
+def get_latency_df() -> pd.DataFrame:
+    with span_stats_lock:
+        span_stats.update()
+        return pd.DataFrame(span_stats.rows(), columns=LATENCY_COLUMNS)
+
+
 # Main UI construction
 def create_ui():
     """Create the main Gradio UI for the trading simulation"""
@@ -181,6 +338,17 @@ def create_ui():
         with gr.Row():
             for trader_view in trader_views:
                 trader_view.make_ui()
+        with gr.Accordion("Latency", open=False):
+            latency_table = gr.Dataframe(
+                value=get_latency_df,
+                headers=LATENCY_COLUMNS,
+                row_count=(10, "dynamic"),
+                col_count=len(LATENCY_COLUMNS),
+                max_height=400,
+                elem_classes=["dataframe-fix"],
+            )
+        latency_timer = gr.Timer(value=60)
+        latency_timer.tick(fn=get_latency_df, outputs=[latency_table], show_progress="hidden", queue=False)
 
     return ui
 
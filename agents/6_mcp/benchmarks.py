@@ -0,0 +1,565 @@
+"""
+Benchmarks for the trading floor's storage and server paths.
+
+Each benchmark runs against a throwaway database in a temporary directory, so it's safe to run
+alongside a live accounts.db. Usage:
+
+    uv run benchmarks.py db_writers [processes] [ops_per_process]
+    uv run benchmarks.py market_lookup [symbols]
+    uv run benchmarks.py account_tools [calls]
+    uv run benchmarks.py order_stress [processes] [orders_per_process]
+    uv run benchmarks.py prompt_tokens
+    uv run benchmarks.py mcp_transports [calls]
+    uv run benchmarks.py startup [budget_ms]
+    uv run benchmarks.py tracer [events]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import tempfile
+import subprocess
+import multiprocessing as mp
+
+
+def use_temp_db(directory: str) -> str:
+    """Point the database module at a fresh file; must run before database is first imported."""
+    path = os.path.join(directory, "bench.db")
+    os.environ["ACCOUNTS_DB"] = path
+    return path
+
+
+# db_writers: N processes doing the mix of account / log / market calls the traders make
+
+
+def _legacy_ops(path: str, worker: int, ops: int) -> None:
+    """The original access pattern: a fresh connection and a rollback-journal commit per call."""
+    for i in range(ops):
+        with sqlite3.connect(path) as conn:
+            conn.execute(
+                "INSERT INTO accounts (name, account) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET account=excluded.account",
+                (f"trader{worker}", json.dumps({"balance": i})),
+            )
+            conn.commit()
+        with sqlite3.connect(path) as conn:
+            conn.execute(
+                "INSERT INTO logs (name, datetime, type, message) VALUES (?, datetime('now'), ?, ?)",
+                (f"trader{worker}", "account", f"op {i}"),
+            )
+            conn.commit()
+        with sqlite3.connect(path) as conn:
+            conn.execute("SELECT account FROM accounts WHERE name = ?", (f"trader{worker}",)).fetchone()
+
+
+def _pooled_ops(path: str, worker: int, ops: int) -> None:
+    from database import write_account, read_account, write_log
+
+    for i in range(ops):
+        write_account(f"trader{worker}", {"balance": i})
+        write_log(f"trader{worker}", "account", f"op {i}")
+        read_account(f"trader{worker}")
+
+
+def _run_writers(target, path: str, processes: int, ops: int) -> float:
+    workers = [mp.Process(target=target, args=(path, w, ops)) for w in range(processes)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    if any(worker.exitcode for worker in workers):
+        raise RuntimeError("A writer process failed (database is locked?)")
+    # Three calls per op: write_account, write_log, read_account
+    return processes * ops * 3 / elapsed
+
+
+def bench_db_writers(processes: int = 4, ops: int = 500) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = use_temp_db(directory)
+        import database
+
+        database.get_connection()  # creates the schema and switches the file to WAL
+        database.close_connections()
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=DELETE")
+        before = _run_writers(_legacy_ops, path, processes, ops)
+
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        after = _run_writers(_pooled_ops, path, processes, ops)
+
+    print(f"db_writers: {processes} processes x {ops} ops")
+    print(f"  connect-per-call, rollback journal: {before:10,.0f} ops/sec")
+    print(f"  pooled connections, WAL:            {after:10,.0f} ops/sec  ({after / before:.1f}x)")
+
+
+# market_lookup: the first price lookup in a freshly started process, as in a respawned MCP server
+
+_LEGACY_LOOKUP = """
+import json, sqlite3, sys, time
+start = time.perf_counter()
+with sqlite3.connect(sys.argv[1]) as conn:
+    data = json.loads(conn.execute("SELECT data FROM market WHERE date = ?", ("2025-01-02",)).fetchone()[0])
+price = data.get(sys.argv[2], 0.0)
+print(time.perf_counter() - start)
+"""
+
+_INDEXED_LOOKUP = """
+import sys, time
+import database
+database.close_connections()
+start = time.perf_counter()
+price = database.read_market_price("2025-01-02", sys.argv[2])
+print(time.perf_counter() - start)
+"""
+
+
+def _cold_lookup(script: str, path: str, symbol: str) -> float:
+    env = {**os.environ, "ACCOUNTS_DB": path}
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-c", script, path, symbol], env=env, cwd=here, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def bench_market_lookup(symbols: int = 10_000, runs: int = 5) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = use_temp_db(directory)
+        legacy_path = os.path.join(directory, "legacy.db")
+        from database import write_market
+
+        rng = random.Random(42)
+        data = {f"T{i:05d}": round(rng.uniform(1, 500), 2) for i in range(symbols)}
+        write_market("2025-01-02", data)
+        with sqlite3.connect(legacy_path) as conn:
+            conn.execute("CREATE TABLE market (date TEXT PRIMARY KEY, data TEXT)")
+            conn.execute("INSERT INTO market VALUES (?, ?)", ("2025-01-02", json.dumps(data)))
+
+        probes = [rng.choice(list(data)) for _ in range(runs)]
+        before = min(_cold_lookup(_LEGACY_LOOKUP, legacy_path, symbol) for symbol in probes)
+        after = min(_cold_lookup(_INDEXED_LOOKUP, path, symbol) for symbol in probes)
+
+    print(f"market_lookup: first lookup in a cold process, {symbols:,} symbols, best of {runs}")
+    print(f"  JSON blob per day:       {before * 1000:8.3f} ms")
+    print(f"  indexed (date, symbol):  {after * 1000:8.3f} ms  ({before / after:.0f}x)")
+
+
+# account_tools: accounts_server tool-call latency as an account's history grows
+
+
+def _history(transactions: int) -> dict:
+    rng = random.Random(7)
+    history, holdings = [], {}
+    for i in range(transactions):
+        symbol = rng.choice(["AAPL", "MSFT", "NVDA", "SPY", "QQQ"])
+        quantity = rng.randint(1, 10) if holdings.get(symbol, 0) < 10 or rng.random() < 0.5 else -rng.randint(1, 10)
+        holdings[symbol] = holdings.get(symbol, 0) + quantity
+        history.append({
+            "symbol": symbol,
+            "quantity": quantity,
+            "price": round(rng.uniform(50, 500), 2),
+            "timestamp": f"2025-01-01 00:00:{i % 60:02d}",
+            "rationale": "Rebalancing toward my long-term allocation after reviewing recent news. " * 2,
+        })
+    return {
+        "name": "bench",
+        "balance": 10_000.0,
+        "strategy": "Benchmark strategy",
+        "transactions": history,
+        "portfolio_value_time_series": [(f"2025-01-01 00:{i % 60:02d}:00", 10_000.0) for i in range(transactions)],
+    }
+
+
+async def _time_calls(fn, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        result = fn()
+        if asyncio.iscoroutine(result):
+            await result
+    return (time.perf_counter() - start) / calls
+
+
+async def _account_tools(calls: int) -> None:
+    from database import replace_account
+    from accounts import Account, Transaction
+    import accounts_server
+
+    def legacy_get(blob: str) -> float:
+        # What every tool call used to do: parse the whole account and validate every transaction
+        fields = json.loads(blob)
+        [Transaction(**transaction) for transaction in fields["transactions"]]
+        return fields["balance"]
+
+    print(f"account_tools: mean latency per call over {calls} calls")
+    print(f"  {'transactions':>12}  {'JSON blob':>10}  {'Account.get':>11}  {'get_balance':>11}  {'get_holdings':>12}")
+    for size in [0, 100, 1_000, 10_000]:
+        history = _history(size)
+        blob = json.dumps(history)
+        replace_account("bench", history)
+        accounts_server.accounts.invalidate("bench")
+        legacy = await _time_calls(lambda: legacy_get(blob), calls)
+        uncached = await _time_calls(lambda: Account.get("bench").balance, calls)
+        balance = await _time_calls(lambda: accounts_server.get_balance("bench"), calls)
+        holdings = await _time_calls(lambda: accounts_server.get_holdings("bench"), calls)
+        print(
+            f"  {size:>12,}  {legacy * 1e6:>8.0f}us  {uncached * 1e6:>9.0f}us  "
+            f"{balance * 1e6:>9.1f}us  {holdings * 1e6:>10.1f}us"
+        )
+
+
+def bench_account_tools(calls: int = 200) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_db(directory)
+        asyncio.run(_account_tools(calls))
+
+
+# order_stress: many processes trading one account at once; every order must land exactly once
+
+
+def _offline_market() -> None:
+    """Price from the deterministic simulator so stress runs never touch the network."""
+    import market
+
+    market.polygon_api_key = None
+
+
+def _stress_orders(worker: int, orders: int, results) -> None:
+    from accounts import Account
+
+    _offline_market()
+    rng = random.Random(worker)
+    account = Account.get("stress")  # deliberately reused, so it's usually stale when this process writes
+    filled = 0
+    try:
+        for _ in range(orders):
+            symbol = rng.choice(["AAPL", "MSFT", "NVDA", "SPY"])
+            try:
+                if rng.random() < 0.6:
+                    account.buy_shares(symbol, rng.randint(1, 3), "stress")
+                else:
+                    account.sell_shares(symbol, 1, "stress")
+                filled += 1
+            except ValueError:
+                pass  # not enough cash or shares, given what the other processes did first
+    finally:
+        results.put(filled)
+
+
+def bench_order_stress(processes: int = 8, orders: int = 50) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_db(directory)
+        from accounts import Account, INITIAL_BALANCE
+        from database import read_transactions
+
+        _offline_market()
+        Account.get("stress").reset("stress test")
+        results = mp.Queue()
+        workers = [mp.Process(target=_stress_orders, args=(w, orders, results)) for w in range(processes)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        filled = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        account = Account.get("stress")
+        ledger = read_transactions("stress")
+        expected_balance = INITIAL_BALANCE - sum(t["quantity"] * t["price"] for t in ledger)
+        problems = account.check_consistency()
+        if len(ledger) != filled:
+            problems.append(f"{filled} orders filled but {len(ledger)} transactions recorded")
+        if abs(account.balance - expected_balance) > 1e-6:
+            problems.append(f"balance is {account.balance:.2f} but the ledger implies {expected_balance:.2f}")
+        if any(quantity < 0 for quantity in account.holdings.values()) or account.balance < 0:
+            problems.append(f"account went negative: {account.balance:.2f}, {account.holdings}")
+
+    print(f"order_stress: {processes} processes x {orders} orders on one account")
+    print(f"  {filled} orders filled in {elapsed:.2f}s ({filled / elapsed:,.0f} orders/sec)")
+    print(f"  final balance {account.balance:,.2f}, holdings {account.holdings}")
+    if problems:
+        print("  FAILED:\n    " + "\n    ".join(problems))
+        sys.exit(1)
+    print("  balance, holdings and positions all match the ledger")
+
+
+# prompt_tokens: size of the trade message each trader is sent, as an account's history grows
+
+
+def _count_tokens(text: str) -> int:
+    """Tokens for gpt-4o family models if tiktoken is installed, otherwise the usual 4 characters a token."""
+    try:
+        import tiktoken
+    except ImportError:
+        return len(text) // 4
+    return len(tiktoken.get_encoding("o200k_base").encode(text))
+
+
+def bench_prompt_tokens() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_db(directory)
+        _offline_market()
+        from database import replace_account
+        from accounts import Account
+        from templates import trade_message
+
+        def full_report(account: Account) -> str:
+            # What Trader.get_account_report used to send: the full report less the time series
+            report = json.loads(account.report())
+            report.pop("portfolio_value_time_series")
+            return json.dumps(report)
+
+        print("prompt_tokens: tokens in a trade message and a buy_shares result as the account's history grows")
+        print(f"  {'transactions':>12}  {'full report':>11}  {'summary':>8}  {'trade result':>12}")
+        for size in [0, 100, 1_000, 10_000]:
+            replace_account("bench", _history(size))
+            account = Account.get("bench")
+            before = _count_tokens(trade_message(account.name, account.strategy, full_report(account)))
+            after = _count_tokens(trade_message(account.name, account.strategy, account.summary()))
+            trade = _count_tokens(account.buy_shares("AAPL", 1, "benchmark"))
+            print(f"  {size:>12,}  {before:>11,}  {after:>8,}  {trade:>12,}")
+
+
+# mcp_transports: connecting to the accounts server and calling a tool over each MCP transport
+
+
+async def _transport_latency(params: dict, calls: int) -> tuple[float, float]:
+    from mcp_transports import create_mcp_server
+
+    server = create_mcp_server(params, client_session_timeout_seconds=30)
+    start = time.perf_counter()
+    await server.connect()
+    connect = time.perf_counter() - start
+    try:
+        await server.call_tool("get_balance", {"name": "bench"})
+        call = await _time_calls(lambda: server.call_tool("get_balance", {"name": "bench"}), calls)
+    finally:
+        await server.cleanup()
+    return connect, call
+
+
+def bench_mcp_transports(calls: int = 200) -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_db(directory)
+        from mcp_params import MCP_HTTP_HOST, local_mcp_servers, local_server_params
+        from mcp_transports import start_local_servers, stop_local_servers
+
+        print(f"mcp_transports: accounts_server get_balance, mean of {calls} calls")
+        print(f"  {'transport':>10}  {'connect':>10}  {'tool call':>10}")
+        for transport in ["stdio", "http", "sse", "inprocess"]:
+            params = local_server_params("accounts_server", transport)
+            processes = []
+            if transport == "stdio":
+                params = {"command": sys.executable, "args": ["accounts_server.py"], "env": dict(os.environ)}
+            elif transport in ("http", "sse"):
+                servers = {"accounts_server": local_mcp_servers["accounts_server"]}
+                processes = start_local_servers(transport, servers, MCP_HTTP_HOST, command=(sys.executable,))
+            try:
+                connect, call = asyncio.run(_transport_latency(params, calls))
+            finally:
+                stop_local_servers(processes)
+            print(f"  {transport:>10}  {connect * 1000:>8.1f}ms  {call * 1000:>8.2f}ms")
+
+
+# startup: import time of each stdio MCP server entry point, which every MCPServerStdio launch pays
+
+STARTUP_SERVERS = ["accounts_server", "market_server", "push_server"]
+# Every server imports FastMCP, which takes most of the startup time and varies a lot from run to run with the
+# machine's load. The budget is for the rest, each server's own imports: measured within the same process it is
+# steady, 16-51ms per server after deferring the modules below and 78-356ms per server before.
+STARTUP_BASELINE = "mcp.server.fastmcp"
+STARTUP_BUDGET_MS = 75
+# Modules that should only be imported once they're actually used
+STARTUP_DEFERRED = ["polygon", "numpy", "market_simulator", "requests"]
+
+
+def _import_times(module: str, shared: set[str] = frozenset()) -> tuple[float, float, set[str]]:
+    """
+    Total import time in seconds per python -X importtime, the part of it not spent importing the shared
+    modules, and the set of modules imported.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=os.environ, cwd=here, capture_output=True, text=True, check=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        entries.append(((len(name) - len(name.lstrip()) - 1) // 2, name.strip(), int(cumulative)))
+    # Top level imports; nested ones are already in their parent's cumulative
+    total = sum(cumulative for depth, _, cumulative in entries if depth == 0)
+    # Each module is listed after the ones it imported, so in reverse a shared module comes before its imports
+    in_shared, shared_depth = 0, None
+    for depth, name, cumulative in reversed(entries):
+        if shared_depth is not None and depth > shared_depth:
+            continue
+        shared_depth = None
+        if name in shared:
+            in_shared += cumulative
+            shared_depth = depth
+    return total / 1e6, (total - in_shared) / 1e6, {name for _, name, _ in entries}
+
+
+def bench_startup(budget_ms: int = STARTUP_BUDGET_MS, runs: int = 3) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_db(directory)
+        problems = []
+        shared = _import_times(STARTUP_BASELINE)[2]
+        print(f"startup: import time of each MCP server, best of {runs}, budget {budget_ms}ms beyond {STARTUP_BASELINE}")
+        print(f"  {'server':>16}  {'total':>10}  {'own':>10}")
+        for server in STARTUP_SERVERS:
+            timings = [_import_times(server, shared) for _ in range(runs)]
+            best = min(total for total, _, _ in timings)
+            own = min(own for _, own, _ in timings)
+            eager = sorted(
+                name for name in timings[0][2] if name.split(".")[0] in STARTUP_DEFERRED
+            )
+            print(f"  {server:>16}  {best * 1000:8.1f}ms  {own * 1000:8.1f}ms")
+            if own * 1000 > budget_ms:
+                problems.append(f"{server} took {own * 1000:.0f}ms to import its own modules, over the {budget_ms}ms budget")
+            if eager:
+                problems.append(f"{server} imports {', '.join(eager[:3])} at startup")
+    if problems:
+        print("  FAILED:\n    " + "\n    ".join(problems))
+        sys.exit(1)
+    print("  all servers within budget")
+
+
+# tracer: what each span event costs the event loop, logging directly vs through LogTracer's queue
+
+
+class _BenchSpanData:
+    type = "function"
+    name = "get_balance"
+    server = None
+    mcp_data = {"server": "accounts"}
+
+
+class _BenchSpan:
+    trace_id = "trace_bench0" + "x" * 26
+    span_id = "span_bench"
+    span_data = _BenchSpanData()
+    error = None
+
+
+def bench_tracer(events: int = 5_000) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_db(directory)
+        from database import write_log, read_log
+        from tracers import LogTracer
+
+        span = _BenchSpan()
+        start = time.perf_counter()
+        for _ in range(events):
+            write_log("bench", "function", "Started function get_balance")
+        direct = (time.perf_counter() - start) / events
+
+        tracer = LogTracer()
+        start = time.perf_counter()
+        for i in range(events):
+            (tracer.on_span_start if i % 2 else tracer.on_span_end)(span)
+        queued = (time.perf_counter() - start) / events
+        start = time.perf_counter()
+        tracer.shutdown()
+        drain = time.perf_counter() - start
+        written = len(list(read_log("bench", last_n=2 * events)))
+
+        print(f"tracer: {events:,} span events")
+        print(f"  write_log per event    {direct * 1e6:8.1f}us")
+        print(f"  LogTracer per event    {queued * 1e6:8.1f}us  ({drain * 1000:.0f}ms to drain the rest on shutdown)")
+        print(f"  rows written           {written:,} of {2 * events:,}")
+
+
+# tool_schemas: the accounts tools as 2_lab2.ipynb hands them to an Agent must satisfy OpenAI's strict mode
+
+
+def _strict_schema_problems(schema, path: str = "") -> list[str]:
+    """What keeps a JSON schema from being accepted in strict mode: open objects, optional properties, defaults."""
+    problems = []
+    if isinstance(schema, list):
+        for i, entry in enumerate(schema):
+            problems += _strict_schema_problems(entry, f"{path}/{i}")
+        return problems
+    if not isinstance(schema, dict):
+        return problems
+    where = path or "/"
+    if schema.get("type") == "object":
+        if schema.get("additionalProperties") is not False:
+            problems.append(f"{where} allows additional properties")
+        optional = set(schema.get("properties", {})) - set(schema.get("required", []))
+        if optional:
+            problems.append(f"{where} doesn't require {', '.join(sorted(optional))}")
+    if "default" in schema:
+        problems.append(f"{where} has a default")
+    if "$ref" in schema and len(schema) > 1:
+        problems.append(f"{where} has a $ref alongside other keywords")
+    for key, value in schema.items():
+        if key in ("properties", "$defs"):
+            for name, entry in value.items():
+                problems += _strict_schema_problems(entry, f"{path}/{key}/{name}")
+        elif isinstance(value, (dict, list)):
+            problems += _strict_schema_problems(value, f"{path}/{key}")
+    return problems
+
+
+def bench_tool_schemas() -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_db(directory)
+        import accounts_client
+        from mcp_params import local_server_params
+
+        # The same tools the notebook gets over stdio, served in-process so the check doesn't need uv
+        accounts_client.params = local_server_params("accounts_server", "inprocess")
+
+        async def tools():
+            try:
+                return await accounts_client.get_accounts_tools_openai()
+            finally:
+                await accounts_client.close_accounts_sessions()
+
+        problems = []
+        print("tool_schemas: accounts tools from get_accounts_tools_openai, checked against strict mode")
+        for tool in asyncio.run(tools()):
+            tool_problems = _strict_schema_problems(tool.params_json_schema)
+            if not tool.strict_json_schema:
+                tool_problems.insert(0, "not marked strict")
+            print(f"  {tool.name:>18}  {'ok' if not tool_problems else '; '.join(tool_problems)}")
+            problems += tool_problems
+    if problems:
+        print("  FAILED")
+        sys.exit(1)
+    print("  all tools strict")
+
+
+BENCHMARKS = {
+    "db_writers": bench_db_writers,
+    "market_lookup": bench_market_lookup,
+    "account_tools": bench_account_tools,
+    "order_stress": bench_order_stress,
+    "prompt_tokens": bench_prompt_tokens,
+    "mcp_transports": bench_mcp_transports,
+    "startup": bench_startup,
+    "tracer": bench_tracer,
+    "tool_schemas": bench_tool_schemas,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: benchmarks.py [{'|'.join(BENCHMARKS)}] [args...]")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*(int(arg) for arg in sys.argv[2:]))
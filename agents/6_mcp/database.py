@@ -1,17 +1,268 @@
+import os
 import sqlite3
 import json
-from datetime import datetime
-from dotenv import load_dotenv
+import time
+import threading
+import atexit
+from contextlib import contextmanager
+from env import load_env
 
-load_dotenv(override=True)
+load_env()
 
-DB = "accounts.db"
+DB = os.getenv("ACCOUNTS_DB", "accounts.db")
 
+# Connection tuning: WAL lets readers and the single writer proceed concurrently, NORMAL synchronous
+# only fsyncs at checkpoints (safe in WAL mode), and busy_timeout waits for a lock instead of failing.
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "10000"))
+SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+STATEMENT_CACHE_SIZE = 256
+# Bump whenever _create_schema changes, so existing databases get migrated on their next open
+SCHEMA_VERSION = 6
 
-with sqlite3.connect(DB) as conn:
-    cursor = conn.cursor()
-    cursor.execute('CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, account TEXT)')
-    cursor.execute('''
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_schema_pid = None
+# Bumped by close_connections, so every thread's next get_connection opens a new connection in place of the closed one
+_generation = 0
+
+
+def _open_connection() -> sqlite3.Connection:
+    # isolation_level=None puts the connection in autocommit mode; multi-statement writes use transaction().
+    # Connections are long-lived, so sqlite3's per-connection statement cache keeps the prepared statements.
+    conn = sqlite3.connect(
+        DB,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the connection for the current thread, opening it on first use or after close_connections, which also
+    makes sure the schema exists. Connections are never shared between threads or inherited across a fork.
+    """
+    global _schema_pid
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid() or _local.generation != _generation:
+        conn = _open_connection()
+        if _schema_pid != os.getpid():
+            _ensure_schema(conn)
+            _schema_pid = os.getpid()
+        with _connections_lock:
+            _connections.append(conn)
+            _local.generation = _generation
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+@contextmanager
+def transaction(immediate: bool = True):
+    """
+    Run a block of statements as a single transaction on this thread's connection.
+    BEGIN IMMEDIATE takes the write lock up front so concurrent writers queue on busy_timeout;
+    pass immediate=False for a read-only block that just needs a consistent snapshot.
+    A block nested inside another transaction simply joins it.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def close_connections() -> None:
+    """Close every connection opened by this process; any thread that queries again gets a new one."""
+    global _generation
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+        _generation += 1
+    _local.conn = None
+
+
+atexit.register(close_connections)
+
+
+# The account row holds the scalar fields (name, balance, strategy) as JSON; the history lives in append-only
+# ledger tables so that a trade writes one transaction row and one holding row instead of the whole account.
+# Each holding row also carries the running cost basis and realized P&L for its symbol; rows are kept at
+# quantity 0 once a position is closed so that its realized P&L survives.
+LEDGER_FIELDS = ("holdings", "positions", "transactions", "portfolio_value_time_series")
+
+
+class ConcurrentUpdateError(Exception):
+    """Raised when an account was changed by someone else since it was read."""
+
+
+def _write_account(conn, name, account_dict, expected_version=None) -> int:
+    """
+    Write the scalar fields and return the account's new version, which is bumped by every write.
+    With expected_version, the write is a compare-and-swap that fails if the account has moved on.
+    """
+    scalars = {key: value for key, value in account_dict.items() if key not in LEDGER_FIELDS + ("version",)}
+    if expected_version is None:
+        row = conn.execute('''
+            INSERT INTO accounts (name, account, version)
+            VALUES (?, ?, 1)
+            ON CONFLICT(name) DO UPDATE SET account=excluded.account, version=version + 1
+            RETURNING version
+        ''', (name.lower(), json.dumps(scalars))).fetchone()
+    else:
+        row = conn.execute('''
+            UPDATE accounts SET account = ?, version = version + 1
+            WHERE name = ? AND version = ?
+            RETURNING version
+        ''', (json.dumps(scalars), name.lower(), expected_version)).fetchone()
+        if row is None:
+            raise ConcurrentUpdateError(f"Account {name} was modified since version {expected_version}")
+    return row[0]
+
+
+def _replace_account(conn, name, account_dict) -> int:
+    name = name.lower()
+    version = _write_account(conn, name, account_dict)
+    conn.execute('DELETE FROM holdings WHERE name = ?', (name,))
+    conn.execute('DELETE FROM transactions WHERE name = ?', (name,))
+    conn.execute('DELETE FROM portfolio_snapshots WHERE name = ?', (name,))
+    conn.executemany(
+        'INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale) VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (name, t["symbol"], t["quantity"], t["price"], t["timestamp"], t["rationale"])
+            for t in account_dict.get("transactions", [])
+        ],
+    )
+    conn.executemany(
+        'INSERT INTO portfolio_snapshots (name, datetime, value) VALUES (?, ?, ?)',
+        [(name, dt, value) for dt, value in account_dict.get("portfolio_value_time_series", [])],
+    )
+    _rebuild_positions(conn, name)
+    return version
+
+
+def _rebuild_positions(conn, name):
+    """Recompute the holdings rows for an account by replaying its transactions at average cost."""
+    positions = {}
+    for symbol, quantity, price in conn.execute(
+        'SELECT symbol, quantity, price FROM transactions WHERE name = ? ORDER BY id', (name,)
+    ):
+        held, cost_basis, realized_pnl = positions.get(symbol, (0, 0.0, 0.0))
+        if quantity > 0:
+            cost_basis += quantity * price
+        elif held:
+            average_price = cost_basis / held
+            realized_pnl += -quantity * (price - average_price)
+            cost_basis = cost_basis + quantity * average_price if held + quantity else 0.0
+        positions[symbol] = (held + quantity, cost_basis, realized_pnl)
+    conn.execute('DELETE FROM holdings WHERE name = ?', (name,))
+    conn.executemany(
+        'INSERT INTO holdings (name, symbol, quantity, cost_basis, realized_pnl) VALUES (?, ?, ?, ?, ?)',
+        [(name, symbol, *position) for symbol, position in positions.items()],
+    )
+
+
+def _create_market_table(conn):
+    """
+    Create the market table with one row per (date, symbol) so a price is a single primary key lookup.
+    The original table held a whole day of prices as one JSON blob; any such days are imported row by row.
+    """
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(market)')]
+    if 'data' in columns:
+        conn.execute('ALTER TABLE market RENAME TO market_blobs')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market (
+            date TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            close REAL NOT NULL,
+            PRIMARY KEY (date, symbol)
+        ) WITHOUT ROWID
+    ''')
+    if 'data' in columns:
+        for date, data in conn.execute('SELECT date, data FROM market_blobs').fetchall():
+            _write_market(conn, date, json.loads(data))
+        conn.execute('DROP TABLE market_blobs')
+
+
+def _write_market(conn, date, data):
+    conn.executemany(
+        'INSERT OR REPLACE INTO market (date, symbol, close) VALUES (?, ?, ?)',
+        [(date, symbol, close) for symbol, close in data.items() if close is not None],
+    )
+
+
+def _add_column(conn, table, column, declaration) -> bool:
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column in columns:
+        return False
+    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+    return True
+
+
+def migrate_account_blobs(conn) -> int:
+    """
+    One-shot migration of accounts stored as a single JSON blob into the ledger tables.
+    Rows that were already migrated no longer carry a transactions list, so this is idempotent.
+    """
+    rows = conn.execute(
+        "SELECT name, account FROM accounts WHERE json_type(account, '$.transactions') IS NOT NULL"
+    ).fetchall()
+    for name, account in rows:
+        _replace_account(conn, name, json.loads(account))
+    return len(rows)
+
+
+def _create_schema(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, account TEXT, version INTEGER NOT NULL DEFAULT 0)')
+    _add_column(conn, 'accounts', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS holdings (
+            name TEXT,
+            symbol TEXT,
+            quantity INTEGER NOT NULL,
+            cost_basis REAL NOT NULL DEFAULT 0,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, symbol)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            rationale TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS transactions_by_name ON transactions (name, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            datetime TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS portfolio_snapshots_by_name ON portfolio_snapshots (name, id)')
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
@@ -20,82 +271,414 @@ with sqlite3.connect(DB) as conn:
             message TEXT
         )
     ''')
-    cursor.execute('CREATE TABLE IF NOT EXISTS market (date TEXT PRIMARY KEY, data TEXT)')
-    conn.commit()
-
-def write_account(name, account_dict):
-    json_data = json.dumps(account_dict)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO accounts (name, account)
-            VALUES (?, ?)
-            ON CONFLICT(name) DO UPDATE SET account=excluded.account
-        ''', (name.lower(), json_data))
-        conn.commit()
+    conn.execute('CREATE INDEX IF NOT EXISTS logs_by_name ON logs (name, id)')
+    # Logs are shown in the order things happened, which isn't always the order they were written: the tracer
+    # writes its events in batches, while other processes write theirs straight away
+    conn.execute('CREATE INDEX IF NOT EXISTS logs_by_time ON logs (name, datetime)')
+    # One row per finished span, with its duration and what it was waiting on: the model, tool or MCP server
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trader TEXT NOT NULL,
+            trace_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            name TEXT,
+            server TEXT,
+            model TEXT,
+            started_at REAL NOT NULL,
+            duration_ms REAL NOT NULL,
+            error TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS spans_by_start ON spans (started_at)')
+    # The token ledger: what each trader's run in a cycle (one trace) used and cost, per model
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS token_usage (
+            trader TEXT NOT NULL,
+            date TEXT NOT NULL,
+            trace_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            input_tokens INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            cost REAL NOT NULL,
+            PRIMARY KEY (trader, trace_id, model)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS token_usage_by_date ON token_usage (trader, date)')
+    _create_market_table(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_cache (
+            symbol TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            fetched_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Upstream calls in flight or just made by any process, so identical calls from other processes can share them
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_calls (
+            key TEXT PRIMARY KEY,
+            claimed_at REAL,
+            fetched_at REAL,
+            result BLOB
+        ) WITHOUT ROWID
+    ''')
+    migrate_account_blobs(conn)
+    # Holdings written before cost basis tracking get their positions backfilled from the ledger
+    if _add_column(conn, 'holdings', 'cost_basis', 'REAL NOT NULL DEFAULT 0'):
+        _add_column(conn, 'holdings', 'realized_pnl', 'REAL NOT NULL DEFAULT 0')
+        for (name,) in conn.execute('SELECT name FROM accounts').fetchall():
+            _rebuild_positions(conn, name)
+
+
+def _ensure_schema(conn) -> None:
+    """
+    Create or migrate the schema the first time this process opens the database. A database already at
+    SCHEMA_VERSION is recognized from its header alone, so a freshly started process doesn't take the write lock.
+    """
+    if conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _create_schema(conn)
+        conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def write_account(name, account_dict, expected_version=None) -> int:
+    """
+    Write the scalar fields of an account; ledger fields in account_dict are ignored. Returns the new version.
+    Raises ConcurrentUpdateError if expected_version is given and the stored version differs.
+    """
+    return _write_account(get_connection(), name, account_dict, expected_version)
+
+def replace_account(name, account_dict) -> int:
+    """Overwrite an account and its entire ledger, e.g. when creating or resetting an account. Returns the new version."""
+    with transaction() as conn:
+        return _replace_account(conn, name, account_dict)
+
+def read_account_version(name) -> int | None:
+    """A cheap check of whether an account has changed since it was last read."""
+    row = get_connection().execute('SELECT version FROM accounts WHERE name = ?', (name.lower(),)).fetchone()
+    return row[0] if row else None
+
+def read_account_stamp(name) -> tuple[int, int] | None:
+    """The account's version and its latest snapshot id: whatever is rendered from the account changes with these."""
+    return get_connection().execute('''
+        SELECT version, (SELECT MAX(id) FROM portfolio_snapshots WHERE name = ?) FROM accounts WHERE name = ?
+    ''', (name.lower(), name.lower())).fetchone()
 
 def read_account(name):
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT account FROM accounts WHERE name = ?', (name.lower(),))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
-    
+    name = name.lower()
+    with transaction(immediate=False) as conn:
+        row = conn.execute('SELECT account, version FROM accounts WHERE name = ?', (name,)).fetchone()
+        if not row:
+            return None
+        account = json.loads(row[0])
+        account["version"] = row[1]
+        account["positions"] = {
+            symbol: {"quantity": quantity, "cost_basis": cost_basis, "realized_pnl": realized_pnl}
+            for symbol, quantity, cost_basis, realized_pnl in conn.execute(
+                'SELECT symbol, quantity, cost_basis, realized_pnl FROM holdings WHERE name = ?', (name,)
+            )
+        }
+        account["holdings"] = {
+            symbol: position["quantity"] for symbol, position in account["positions"].items() if position["quantity"]
+        }
+    return account
+
+def record_transactions(name, account_dict, transaction_dicts, position_dicts, expected_version=None) -> int:
+    """
+    Append transactions to the ledger, set the resulting positions (quantity, cost basis, realized P&L)
+    keyed by symbol, and update the account's scalar fields, all in a single write transaction.
+    Returns the account's new version; if expected_version is stale, nothing is written and
+    ConcurrentUpdateError is raised.
+    """
+    name = name.lower()
+    with transaction() as conn:
+        version = _write_account(conn, name, account_dict, expected_version)
+        conn.executemany(
+            'INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale) VALUES (?, ?, ?, ?, ?, ?)',
+            [(name, t["symbol"], t["quantity"], t["price"], t["timestamp"], t["rationale"]) for t in transaction_dicts],
+        )
+        conn.executemany('''
+            INSERT INTO holdings (name, symbol, quantity, cost_basis, realized_pnl)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name, symbol) DO UPDATE SET
+                quantity=excluded.quantity, cost_basis=excluded.cost_basis, realized_pnl=excluded.realized_pnl
+        ''', [
+            (name, symbol, p["quantity"], p["cost_basis"], p["realized_pnl"]) for symbol, p in position_dicts.items()
+        ])
+    return version
+
+def read_transactions(name, limit=None, offset=0):
+    """
+    Read an account's transaction ledger, oldest first. With a limit, read just that many of the most recent
+    transactions, skipping the newest offset of them, e.g. limit=20, offset=20 for the 20 before the last 20.
+    """
+    if limit is None:
+        cursor = get_connection().execute('''
+            SELECT symbol, quantity, price, timestamp, rationale FROM transactions
+            WHERE name = ?
+            ORDER BY id
+        ''', (name.lower(),))
+    else:
+        cursor = get_connection().execute('''
+            SELECT * FROM (
+                SELECT id, symbol, quantity, price, timestamp, rationale FROM transactions
+                WHERE name = ?
+                ORDER BY id DESC
+                LIMIT ? OFFSET ?
+            ) ORDER BY id
+        ''', (name.lower(), limit, offset))
+        cursor = (row[1:] for row in cursor)
+    return [
+        {"symbol": symbol, "quantity": quantity, "price": price, "timestamp": timestamp, "rationale": rationale}
+        for symbol, quantity, price, timestamp, rationale in cursor
+    ]
+
+def count_transactions(name, since: str = "") -> int:
+    return get_connection().execute(
+        'SELECT COUNT(*) FROM transactions WHERE name = ? AND timestamp >= ?', (name.lower(), since)
+    ).fetchone()[0]
+
+def read_portfolio_value_time_series(name):
+    cursor = get_connection().execute(
+        'SELECT datetime, value FROM portfolio_snapshots WHERE name = ? ORDER BY id', (name.lower(),)
+    )
+    return cursor.fetchall()
+
+def read_latest_portfolio_snapshot(name):
+    """Return (id, datetime, value) for the most recent snapshot, or None if there isn't one."""
+    return get_connection().execute(
+        'SELECT id, datetime, value FROM portfolio_snapshots WHERE name = ? ORDER BY id DESC LIMIT 1', (name.lower(),)
+    ).fetchone()
+
+def write_portfolio_snapshot(name: str, timestamp: str, value: float):
+    get_connection().execute(
+        'INSERT INTO portfolio_snapshots (name, datetime, value) VALUES (?, ?, ?)',
+        (name.lower(), timestamp, value),
+    )
+
+def checkpoint() -> None:
+    """Copy the WAL into the main database file and fsync it, e.g. before a process shuts down."""
+    get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
 def write_log(name: str, type: str, message: str):
     """
     Write a log entry to the logs table.
-    
+
     Args:
         name (str): The name associated with the log
         type (str): The type of log entry
         message (str): The log message
     """
-    now = datetime.now().isoformat()
-    
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
+    get_connection().execute('''
+        INSERT INTO logs (name, datetime, type, message)
+        VALUES (?, strftime('%Y-%m-%d %H:%M:%f', 'now'), ?, ?)
+    ''', (name.lower(), type, message))
+
+def write_logs(entries: list[tuple[str, float, str, str]]) -> None:
+    """Write a batch of (name, unix time, type, message) log entries in one statement, stamped with their own times."""
+    if not entries:
+        return
+    with transaction() as conn:
+        conn.executemany('''
             INSERT INTO logs (name, datetime, type, message)
-            VALUES (?, datetime('now'), ?, ?)
-        ''', (name.lower(), type, message))
-        conn.commit()
+            VALUES (?, strftime('%Y-%m-%d %H:%M:%f', ?, 'unixepoch'), ?, ?)
+        ''', [(name.lower(), at, type, message) for name, at, type, message in entries])
 
 def read_log(name: str, last_n=10):
     """
-    Read the most recent log entries for a given name.
-    
+    Read the most recent log entries for a given name, in the order they happened.
+
     Args:
         name (str): The name to retrieve logs for
         last_n (int): Number of most recent entries to retrieve
-        
+
     Returns:
         list: A list of tuples containing (datetime, type, message)
     """
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT datetime, type, message FROM logs 
-            WHERE name = ? 
-            ORDER BY datetime DESC
-            LIMIT ?
-        ''', (name.lower(), last_n))
-        
-        return reversed(cursor.fetchall())
+    cursor = get_connection().execute('''
+        SELECT datetime, type, message FROM logs
+        WHERE name = ?
+        ORDER BY datetime DESC, id DESC
+        LIMIT ?
+    ''', (name.lower(), last_n))
+    return reversed(cursor.fetchall())
+
+def read_log_since(name: str, after_id: int = 0, last_n=10):
+    """
+    Read up to the last_n most recently written log entries for a name that are newer than after_id, as
+    (id, datetime, type, message) in the order they happened. A seek on the (name, id) index, so polling it is
+    cheap when nothing changed. A batch written late can hold entries older than ones already read, so callers
+    keeping a running list should merge these into it by datetime.
+    """
+    cursor = get_connection().execute('''
+        SELECT id, datetime, type, message FROM logs
+        WHERE name = ? AND id > ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), after_id, last_n))
+    return sorted(cursor.fetchall(), key=lambda row: (row[1], row[0]))
+
+def write_spans(spans: list[tuple]) -> None:
+    """Write a batch of (trader, trace_id, type, name, server, model, started_at, duration_ms, error) spans."""
+    if not spans:
+        return
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO spans (trader, trace_id, type, name, server, model, started_at, duration_ms, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', spans)
+
+def read_spans(after_id: int = 0, since: float = 0.0):
+    """Iterate over (id, started_at, type, name, server, model, duration_ms, error) for spans newer than after_id and since."""
+    return get_connection().execute('''
+        SELECT id, started_at, type, name, server, model, duration_ms, error FROM spans
+        WHERE id > ? AND started_at >= ?
+        ORDER BY id
+    ''', (after_id, since))
+
+def write_token_usage(usage: list[tuple]) -> None:
+    """Add a batch of (trader, date, trace_id, model, input_tokens, output_tokens, cost) model calls to the ledger."""
+    if not usage:
+        return
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO token_usage (trader, date, trace_id, model, requests, input_tokens, output_tokens, cost)
+            VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT(trader, trace_id, model) DO UPDATE SET
+                requests = requests + 1,
+                input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                cost = cost + excluded.cost
+        ''', [(trader.lower(), *rest) for trader, *rest in usage])
+
+def read_tokens_used(trader: str, date: str) -> int:
+    row = get_connection().execute(
+        'SELECT COALESCE(SUM(input_tokens + output_tokens), 0) FROM token_usage WHERE trader = ? AND date = ?',
+        (trader.lower(), date),
+    ).fetchone()
+    return row[0]
+
+def read_token_usage(since: str):
+    """Per trader and model since a date: (trader, model, runs, requests, input_tokens, output_tokens, cost)."""
+    return get_connection().execute('''
+        SELECT trader, model, COUNT(DISTINCT trace_id), SUM(requests), SUM(input_tokens), SUM(output_tokens), SUM(cost)
+        FROM token_usage WHERE date >= ?
+        GROUP BY trader, model
+        ORDER BY trader, model
+    ''', (since,)).fetchall()
 
 def write_market(date: str, data: dict) -> None:
-    data_json = json.dumps(data)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO market (date, data)
-            VALUES (?, ?)
-            ON CONFLICT(date) DO UPDATE SET data=excluded.data
-        ''', (date, data_json))
-        conn.commit()
+    """Bulk load a day of closing prices, keyed by symbol, in a single transaction."""
+    with transaction() as conn:
+        _write_market(conn, date, data)
 
 def read_market(date: str) -> dict | None:
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT data FROM market WHERE date = ?', (date,))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
\ No newline at end of file
+    cursor = get_connection().execute('SELECT symbol, close FROM market WHERE date = ?', (date,))
+    data = dict(cursor.fetchall())
+    return data or None
+
+def read_market_price(date: str, symbol: str) -> float | None:
+    row = get_connection().execute(
+        'SELECT close FROM market WHERE date = ? AND symbol = ?', (date, symbol)
+    ).fetchone()
+    return row[0] if row else None
+
+def read_market_prices(date: str, symbols: list[str]) -> dict[str, float]:
+    """Look up the close for several symbols in one query; symbols without a row are left out."""
+    cursor = get_connection().execute(
+        'SELECT symbol, close FROM market WHERE date = ? AND symbol IN (SELECT value FROM json_each(?))',
+        (date, json.dumps(list(symbols))),
+    )
+    return dict(cursor.fetchall())
+
+def has_market(date: str) -> bool:
+    row = get_connection().execute('SELECT 1 FROM market WHERE date = ? LIMIT 1', (date,)).fetchone()
+    return row is not None
+
+def read_cached_prices(symbols: list[str], max_age: float) -> dict[str, float]:
+    """Return the fresh shared cached prices among these symbols, in one query."""
+    cursor = get_connection().execute(
+        'SELECT symbol, price FROM price_cache WHERE symbol IN (SELECT value FROM json_each(?)) AND fetched_at >= ?',
+        (json.dumps(list(symbols)), time.time() - max_age),
+    )
+    return dict(cursor.fetchall())
+
+def write_cached_prices(prices: dict[str, float]) -> None:
+    now = time.time()
+    get_connection().executemany(
+        'INSERT OR REPLACE INTO price_cache (symbol, price, fetched_at) VALUES (?, ?, ?)',
+        [(symbol, price, now) for symbol, price in prices.items()],
+    )
+
+def take_rate_limit_token(name: str, rate: float, capacity: float) -> float:
+    """
+    Take one token from a token bucket shared by every process using the DB, refilling at rate tokens per second.
+    Returns 0 if a token was taken, otherwise the number of seconds to wait before trying again.
+    """
+    now = time.time()
+    with transaction() as conn:
+        row = conn.execute('SELECT tokens, updated_at FROM rate_limits WHERE name = ?', (name,)).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * rate) if row else capacity
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+        conn.execute(
+            'INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)',
+            (name, tokens - 1 if not wait else tokens, now),
+        )
+    return wait
+
+def _shared_call_state(row, now: float, window: float, claim_timeout: float) -> tuple[str, str | None] | None:
+    if row:
+        claimed_at, fetched_at, result = row
+        if result is not None and fetched_at >= now - window:
+            return "result", result
+        if claimed_at is not None and claimed_at >= now - claim_timeout and (fetched_at or 0) < claimed_at:
+            return "wait", None
+    return None
+
+def claim_shared_call(key: str, window: float, claim_timeout: float) -> tuple[str, str | None]:
+    """
+    Claim an upstream call for this process, unless another process already made it in the last window seconds
+    ("result", with its JSON result) or claimed it in the last claim_timeout seconds and hasn't finished ("wait").
+    Returns ("claimed", None) when this process should make the call and then write_shared_call_result.
+    Checking is a plain read, so processes waiting on a call don't take the write lock; only claiming does.
+    """
+    query = 'SELECT claimed_at, fetched_at, result FROM shared_calls WHERE key = ?'
+    state = _shared_call_state(get_connection().execute(query, (key,)).fetchone(), time.time(), window, claim_timeout)
+    if state:
+        return state
+    now = time.time()
+    with transaction() as conn:
+        # Checked again under the write lock, in case another process claimed it since
+        state = _shared_call_state(conn.execute(query, (key,)).fetchone(), now, window, claim_timeout)
+        if state:
+            return state
+        conn.execute('''
+            INSERT INTO shared_calls (key, claimed_at) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET claimed_at = excluded.claimed_at
+        ''', (key, now))
+    return "claimed", None
+
+def write_shared_call_result(key: str, result: str, keep: float = 3600) -> None:
+    now = time.time()
+    with transaction() as conn:
+        conn.execute(
+            'UPDATE shared_calls SET claimed_at = NULL, fetched_at = ?, result = ? WHERE key = ?', (now, result, key)
+        )
+        conn.execute('DELETE FROM shared_calls WHERE claimed_at IS NULL AND fetched_at < ?', (now - keep,))
+
+def release_shared_call(key: str) -> None:
+    """Give up a claim after the call failed, so the next process to try makes the call itself."""
+    get_connection().execute('UPDATE shared_calls SET claimed_at = NULL WHERE key = ?', (key,))
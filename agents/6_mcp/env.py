@@ -0,0 +1,8 @@
+from functools import cache
+from dotenv import load_dotenv
+
+
+@cache
+def load_env() -> None:
+    """Load .env into the environment, once per process however many modules ask for it."""
+    load_dotenv(override=True)
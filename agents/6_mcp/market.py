@@ -1,13 +1,12 @@
-from polygon import RESTClient
-from dotenv import load_dotenv
+from env import load_env
 import os
+import time
+import atexit
 from datetime import datetime
-import random
-from database import write_market, read_market
-from functools import lru_cache
+from database import write_market, read_market_prices, has_market, read_cached_prices, write_cached_prices, write_log
 from datetime import timezone
 
-load_dotenv(override=True)
+load_env()
 
 polygon_api_key = os.getenv("POLYGON_API_KEY")
 polygon_plan = os.getenv("POLYGON_PLAN")
@@ -15,56 +14,186 @@ polygon_plan = os.getenv("POLYGON_PLAN")
 is_paid_polygon = polygon_plan == "paid"
 is_realtime_polygon = polygon_plan == "realtime"
 
+# Prices are shared between every process on the host through the price_cache table, so a freshly spawned
+# MCP server starts warm. How long a price stays fresh depends on how fresh the plan's data is to begin with.
+
+PRICE_CACHE_TTL_EOD = float(os.getenv("PRICE_CACHE_TTL_EOD", "3600"))
+PRICE_CACHE_TTL_DELAYED = float(os.getenv("PRICE_CACHE_TTL_DELAYED", "60"))
+PRICE_CACHE_TTL_REALTIME = float(os.getenv("PRICE_CACHE_TTL_REALTIME", "5"))
+
+if is_realtime_polygon:
+    price_cache_ttl = PRICE_CACHE_TTL_REALTIME
+elif is_paid_polygon:
+    price_cache_ttl = PRICE_CACHE_TTL_DELAYED
+else:
+    price_cache_ttl = PRICE_CACHE_TTL_EOD
+
+# Each process counts its own cache lookups and writes them to the logs table every PRICE_CACHE_STATS_LOG_SECONDS
+# (checked on each lookup), at the end of each warm_price_cache and when it exits
+PRICE_CACHE_STATS_LOG_SECONDS = 300
+price_cache_stats = {"hits": 0, "misses": 0}
+_stats_logged = dict(price_cache_stats)
+_stats_logged_at = time.monotonic()
+
+# Without a Polygon key, prices come from a deterministic simulated market instead
+
+MARKET_SIMULATOR_SEED = int(os.getenv("MARKET_SIMULATOR_SEED", "42"))
+_simulator = None
+
+
+def get_polygon_client():
+    # Imported on first use: the polygon package takes about a quarter of a second to import, which every
+    # freshly spawned MCP server would otherwise pay even when no price is ever fetched from Polygon
+    from polygon_client import get_polygon_client
+
+    return get_polygon_client()
+
+
+def get_simulator():
+    global _simulator
+    if _simulator is None:
+        from market_simulator import MarketSimulator
+
+        _simulator = MarketSimulator(seed=MARKET_SIMULATOR_SEED)
+    return _simulator
+
+
+# What each Polygon call is reduced to before its result is shared with other processes (see PolygonClient.call)
+
+def _market_state(market_status) -> str:
+    return market_status.market
+
+
+def _first_timestamp(aggs) -> int:
+    return aggs[0].timestamp
+
+
+def _closes(aggs) -> dict[str, float]:
+    return {agg.ticker: agg.close for agg in aggs}
+
+
+def _latest_prices(snapshots) -> dict[str, float]:
+    return {
+        snapshot.ticker: (snapshot.min.close if snapshot.min else None) or snapshot.prev_day.close
+        for snapshot in snapshots
+    }
+
 
 def is_market_open() -> bool:
-    client = RESTClient(polygon_api_key)
-    market_status = client.get_market_status()
-    return market_status.market == "open"
+    if not polygon_api_key:
+        return get_simulator().is_market_open()
+    return get_polygon_client().call("get_market_status", extract=_market_state) == "open"
 
 
 def get_all_share_prices_polygon_eod() -> dict[str, float]:
     """With much thanks to student Reema R. for fixing the timezone issue with this!"""
-    client = RESTClient(polygon_api_key)
+    client = get_polygon_client()
+
+    probe_timestamp = client.call("get_previous_close_agg", "SPY", extract=_first_timestamp)
+    last_close = datetime.fromtimestamp(probe_timestamp / 1000, tz=timezone.utc).date()
+
+    return client.call("get_grouped_daily_aggs", last_close, adjusted=True, include_otc=False, extract=_closes)
 
-    probe = client.get_previous_close_agg("SPY")[0]
-    last_close = datetime.fromtimestamp(probe.timestamp / 1000, tz=timezone.utc).date()
 
-    results = client.get_grouped_daily_aggs(last_close, adjusted=True, include_otc=False)
-    return {result.ticker: result.close for result in results}
+_loaded_dates = set()
 
 
-@lru_cache(maxsize=2)
-def get_market_for_prior_date(today):
-    market_data = read_market(today)
-    if not market_data:
-        market_data = get_all_share_prices_polygon_eod()
-        write_market(today, market_data)
-    return market_data
+def ensure_market_for_prior_date(today) -> None:
+    """Make sure the prior close for every symbol is in the market table, loading it once per day."""
+    if today in _loaded_dates:
+        return
+    if not has_market(today):
+        write_market(today, get_all_share_prices_polygon_eod())
+    _loaded_dates.add(today)
 
 
-def get_share_price_polygon_eod(symbol) -> float:
+def get_share_prices_polygon_eod(symbols) -> dict[str, float]:
     today = datetime.now().date().strftime("%Y-%m-%d")
-    market_data = get_market_for_prior_date(today)
-    return market_data.get(symbol, 0.0)
+    prices = read_market_prices(today, symbols)
+    if len(prices) < len(symbols) and today not in _loaded_dates:
+        ensure_market_for_prior_date(today)
+        prices = read_market_prices(today, symbols)
+    return {symbol: prices.get(symbol, 0.0) for symbol in symbols}
 
 
-def get_share_price_polygon_min(symbol) -> float:
-    client = RESTClient(polygon_api_key)
-    result = client.get_snapshot_ticker("stocks", symbol)
-    return result.min.close or result.prev_day.close
+def get_share_prices_polygon_min(symbols) -> dict[str, float]:
+    prices = get_polygon_client().call("get_snapshot_all", "stocks", tickers=list(symbols), extract=_latest_prices)
+    return {symbol: prices.get(symbol) or 0.0 for symbol in symbols}
 
 
-def get_share_price_polygon(symbol) -> float:
+def get_share_prices_polygon(symbols) -> dict[str, float]:
     if is_paid_polygon:
-        return get_share_price_polygon_min(symbol)
+        return get_share_prices_polygon_min(symbols)
     else:
-        return get_share_price_polygon_eod(symbol)
+        return get_share_prices_polygon_eod(symbols)
+
+
+def get_share_prices(symbols) -> dict[str, float]:
+    """Price several symbols at once: one cache query, then one upstream request or DB query for the misses."""
+    symbols = list(dict.fromkeys(symbols))
+    prices = {}
+    if polygon_api_key and symbols:
+        prices = read_cached_prices(symbols, price_cache_ttl)
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        price_cache_stats["hits"] += len(prices)
+        price_cache_stats["misses"] += len(missing)
+        if time.monotonic() - _stats_logged_at > PRICE_CACHE_STATS_LOG_SECONDS:
+            log_price_cache_stats()
+        if missing:
+            try:
+                fetched = get_share_prices_polygon(missing)
+                write_cached_prices(fetched)
+                prices.update(fetched)
+            except Exception as e:
+                print(f"Was not able to use the polygon API due to {e}; using the market simulator")
+    missing = [symbol for symbol in symbols if symbol not in prices]
+    if missing:
+        prices.update(get_simulator().prices(missing))
+    return {symbol: prices[symbol] for symbol in symbols}
 
 
 def get_share_price(symbol) -> float:
-    if polygon_api_key:
-        try:
-            return get_share_price_polygon(symbol)
-        except Exception as e:
-            print(f"Was not able to use the polygon API due to {e}; using a random number")
-    return float(random.randint(1, 100))
+    return get_share_prices([symbol])[symbol]
+
+
+def warm_price_cache(symbols) -> int:
+    """Fetch any of these symbols missing from the shared price cache, e.g. at the start of a trading cycle."""
+    if not polygon_api_key:
+        return 0
+    symbols = list(set(symbols))
+    missing = [symbol for symbol in symbols if symbol not in read_cached_prices(symbols, price_cache_ttl)]
+    price_cache_stats["hits"] += len(symbols) - len(missing)
+    price_cache_stats["misses"] += len(missing)
+    try:
+        if missing:
+            write_cached_prices(get_share_prices_polygon(missing))
+    except Exception as e:
+        print(f"Was not able to warm the price cache due to {e}")
+        return 0
+    finally:
+        log_price_cache_stats()
+    return len(missing)
+
+
+def get_price_cache_stats() -> dict[str, float]:
+    """Hit and miss counts for the shared price cache in this process."""
+    lookups = price_cache_stats["hits"] + price_cache_stats["misses"]
+    hit_rate = price_cache_stats["hits"] / lookups if lookups else 0.0
+    return {**price_cache_stats, "hit_rate": hit_rate}
+
+
+def log_price_cache_stats() -> None:
+    """Write the price cache's hits and misses since the last time to the logs table, if there were any."""
+    global _stats_logged, _stats_logged_at
+    hits = price_cache_stats["hits"] - _stats_logged["hits"]
+    misses = price_cache_stats["misses"] - _stats_logged["misses"]
+    _stats_logged, _stats_logged_at = dict(price_cache_stats), time.monotonic()
+    if hits or misses:
+        write_log(
+            "market",
+            "market",
+            f"Price cache: {hits} hits, {misses} misses ({hits / (hits + misses):.0%} hit rate) in process {os.getpid()}",
+        )
+
+
+atexit.register(log_price_cache_stats)
@@ -1,5 +1,6 @@
+import sys
 from mcp.server.fastmcp import FastMCP
-from market import get_share_price
+from market import get_share_price, get_share_prices
 
 mcp = FastMCP("market_server")
 
@@ -12,5 +13,18 @@ async def lookup_share_price(symbol: str) -> float:
     """
     return get_share_price(symbol)
 
+@mcp.tool()
+async def lookup_share_prices(symbols: list[str]) -> dict[str, float]:
+    """This tool provides the current prices of several stock symbols in a single lookup.
+    Prefer it to calling lookup_share_price repeatedly.
+
+    Args:
+        symbols: the symbols of the stocks
+    """
+    return get_share_prices(symbols)
+
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
\ No newline at end of file
+    # Optional arguments: a transport ("stdio", "streamable-http" or "sse") and, for HTTP, a port
+    if len(sys.argv) > 2:
+        mcp.settings.port = int(sys.argv[2])
+    mcp.run(transport=sys.argv[1] if len(sys.argv) > 1 else "stdio")
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""
+A deterministic, seedable stock market for running the trading floor without a Polygon API key.
+
+Daily closes follow geometric Brownian motion driven by a market factor, a sector factor and idiosyncratic
+noise, with the market switching between calm and stressed regimes and occasional jumps per stock.
+Every stock's path depends only on the seed and its symbol, so any process asking for (symbol, time)
+gets the same price. Paths are generated in bulk with NumPy the first time a symbol is asked for;
+intraday prices are a Brownian bridge between consecutive closes in 5 minute steps.
+"""
+
+import zlib
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
+
+NEW_YORK = ZoneInfo("America/New_York")
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+STEPS_PER_DAY = 78  # 5 minute steps in the 6.5 hour session
+
+START_DATE = date(2025, 1, 2)
+SIMULATION_DAYS = 252 * 6
+TRADING_DAY = 1 / 252
+
+# Market regimes: daily probability of staying put, annual drift and annual volatility of the market factor
+REGIME_STAY = np.array([0.985, 0.94])
+REGIME_DRIFT = np.array([0.14, -0.20])
+REGIME_VOLATILITY = np.array([0.12, 0.30])
+
+SECTORS = 11
+SECTOR_VOLATILITY = 0.08
+JUMPS_PER_YEAR = 2.0
+JUMP_MEAN = -0.01
+JUMP_VOLATILITY = 0.06
+
+
+def _symbol_seed(symbol: str) -> int:
+    return zlib.crc32(symbol.encode())
+
+
+class MarketSimulator:
+    def __init__(self, seed: int = 42, start: date = START_DATE, days: int = SIMULATION_DAYS):
+        self.seed = seed
+        self.start = start
+        self.days = days
+        self._closes: dict[str, np.ndarray] = {}
+
+        rng = np.random.default_rng([seed, 0])
+        regimes = np.zeros(days, dtype=int)
+        stay = rng.random(days)
+        for day in range(1, days):
+            previous = regimes[day - 1]
+            regimes[day] = previous if stay[day] < REGIME_STAY[previous] else 1 - previous
+        self.regimes = regimes
+        self.market_shocks = rng.standard_normal(days)
+        self.sector_shocks = rng.standard_normal((days, SECTORS))
+
+    # Paths
+
+    def _generate(self, symbols: list[str]) -> None:
+        """Generate the daily closes for these symbols in one vectorized pass."""
+        n = len(symbols)
+        s0, beta, idio_vol, jump_sizes, jump_draws, idio_shocks = (
+            np.empty(n), np.empty(n), np.empty(n),
+            np.empty((self.days, n)), np.empty((self.days, n)), np.empty((self.days, n)),
+        )
+        for i, symbol in enumerate(symbols):
+            rng = np.random.default_rng([self.seed, 1, _symbol_seed(symbol)])
+            s0[i] = np.exp(rng.uniform(np.log(5), np.log(500)))
+            beta[i] = rng.uniform(0.5, 1.6)
+            idio_vol[i] = rng.uniform(0.10, 0.40)
+            idio_shocks[:, i] = rng.standard_normal(self.days)
+            jump_draws[:, i] = rng.random(self.days)
+            jump_sizes[:, i] = rng.normal(JUMP_MEAN, JUMP_VOLATILITY, self.days)
+        sectors = np.array([_symbol_seed(symbol) % SECTORS for symbol in symbols])
+
+        market_vol = REGIME_VOLATILITY[self.regimes][:, None]
+        drift = beta * REGIME_DRIFT[self.regimes][:, None]
+        variance = (beta * market_vol) ** 2 + SECTOR_VOLATILITY**2 + idio_vol**2
+        diffusion = (
+            beta * market_vol * self.market_shocks[:, None]
+            + SECTOR_VOLATILITY * self.sector_shocks[:, sectors]
+            + idio_vol * idio_shocks
+        ) * np.sqrt(TRADING_DAY)
+        jumps = np.where(jump_draws < JUMPS_PER_YEAR * TRADING_DAY, jump_sizes, 0.0)
+        log_returns = (drift - 0.5 * variance) * TRADING_DAY + diffusion + jumps
+        log_returns[0] = 0.0
+        closes = s0 * np.exp(np.cumsum(log_returns, axis=0))
+        for i, symbol in enumerate(symbols):
+            self._closes[symbol] = closes[:, i].astype(np.float32)
+
+    def _paths(self, symbols) -> list[np.ndarray]:
+        missing = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self._closes]
+        if missing:
+            self._generate(missing)
+        return [self._closes[symbol] for symbol in symbols]
+
+    # Calendar
+
+    def _day_index(self, day: date) -> int:
+        """Index of the most recent trading day on or before this date, clamped to the simulated range."""
+        index = int(np.busday_count(self.start, day + timedelta(days=1))) - 1
+        return min(max(index, 0), self.days - 1)
+
+    def is_market_open(self, when: datetime | None = None) -> bool:
+        now = (when or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+        return bool(np.is_busday(now.date())) and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+    # Prices
+
+    def prices(self, symbols, when: datetime | None = None) -> dict[str, float]:
+        """Prices at a moment in time: the latest close outside market hours, an intraday price during them."""
+        symbols = list(symbols)
+        now = (when or datetime.now(NEW_YORK)).astimezone(NEW_YORK)
+        day = now.date()
+        session = datetime.combine(day, MARKET_OPEN, NEW_YORK), datetime.combine(day, MARKET_CLOSE, NEW_YORK)
+        if not self.is_market_open(now):
+            if np.is_busday(day) and now < session[0]:
+                day -= timedelta(days=1)
+            index = self._day_index(day)
+            return {symbol: round(float(path[index]), 2) for symbol, path in zip(symbols, self._paths(symbols))}
+
+        index = self._day_index(day)
+        fraction = (now - session[0]) / (session[1] - session[0])
+        step = int(fraction * STEPS_PER_DAY)
+        fraction = step / STEPS_PER_DAY
+        prices = {}
+        for symbol, path in zip(symbols, self._paths(symbols)):
+            previous, close = np.log(path[max(index - 1, 0)]), np.log(path[index])
+            noise = np.random.default_rng([self.seed, 3, _symbol_seed(symbol), index, step]).standard_normal()
+            bridge = 0.02 * np.sqrt(fraction * (1 - fraction)) * noise
+            prices[symbol] = round(float(np.exp((1 - fraction) * previous + fraction * close + bridge)), 2)
+        return prices
+
+    def price(self, symbol: str, when: datetime | None = None) -> float:
+        return self.prices([symbol], when)[symbol]
@@ -1,12 +1,37 @@
 import os
-from dotenv import load_dotenv
+from env import load_env
 from market import is_paid_polygon, is_realtime_polygon
 
-load_dotenv(override=True)
+load_env()
 
 brave_env = {"BRAVE_API_KEY": os.getenv("BRAVE_API_KEY")}
 polygon_api_key = os.getenv("POLYGON_API_KEY")
 
+# How to reach our own FastMCP servers: "stdio" launches one per connection, "http" or "sse" share one local
+# service per server between every trader, and "inprocess" imports them into the trading floor itself.
+# See mcp_transports.py; trading_floor.py starts the local services for http and sse.
+
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "stdio").strip().lower()
+MCP_HTTP_HOST = "127.0.0.1"
+MCP_HTTP_PORT = int(os.getenv("MCP_HTTP_PORT", "8101"))
+local_mcp_servers = {
+    "accounts_server": MCP_HTTP_PORT,
+    "push_server": MCP_HTTP_PORT + 1,
+    "market_server": MCP_HTTP_PORT + 2,
+}
+
+
+def local_server_params(name: str, transport: str = MCP_TRANSPORT) -> dict:
+    if transport == "stdio":
+        return {"command": "uv", "args": ["run", f"{name}.py"]}
+    if transport == "http":
+        return {"url": f"http://{MCP_HTTP_HOST}:{local_mcp_servers[name]}/mcp"}
+    if transport == "sse":
+        return {"url": f"http://{MCP_HTTP_HOST}:{local_mcp_servers[name]}/sse"}
+    if transport == "inprocess":
+        return {"module": name}
+    raise ValueError(f"Unknown MCP_TRANSPORT {transport!r}; use stdio, http, sse or inprocess")
+
 # The MCP server for the Trader to read Market Data
 
 if is_paid_polygon or is_realtime_polygon:
@@ -16,14 +41,14 @@ if is_paid_polygon or is_realtime_polygon:
         "env": {"POLYGON_API_KEY": polygon_api_key},
     }
 else:
-    market_mcp = {"command": "uv", "args": ["run", "market_server.py"]}
+    market_mcp = local_server_params("market_server")
 
 
 # The full set of MCP servers for the trader: Accounts, Push Notification and the Market
 
 trader_mcp_server_params = [
-    {"command": "uv", "args": ["run", "accounts_server.py"]},
-    {"command": "uv", "args": ["run", "push_server.py"]},
+    local_server_params("accounts_server"),
+    local_server_params("push_server"),
     market_mcp,
 ]
 
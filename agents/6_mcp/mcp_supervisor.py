@@ -0,0 +1,147 @@
+import os
+import json
+import asyncio
+from agents.mcp import MCPServer
+from mcp_params import trader_mcp_server_params, researcher_mcp_server_params
+from mcp_transports import create_mcp_server
+from research_cache import ResearchCache, CachingMCPServer
+from database import write_log
+
+CLIENT_SESSION_TIMEOUT_SECONDS = 120
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.getenv("MCP_HEALTH_CHECK_TIMEOUT_SECONDS", "10"))
+
+
+class MCPServerUnavailable(Exception):
+    """Raised when a server a run needs isn't running, rather than letting it run with only some of its tools."""
+
+
+class MCPSupervisor:
+    """
+    Starts the trading floor's MCP servers once and keeps them running across cycles, so each trader run
+    reuses connected servers instead of launching its own. Servers shared by every trader are started once;
+    per-trader servers (each researcher's memory) are started once per trader and kept warm.
+
+    An MCP stdio connection has to be closed by the task that opened it, so each server is owned by its own
+    background task, which connects it, waits to be told to stop and then cleans it up. That lets servers
+    start in parallel and be restarted one at a time. Traders just make requests on the connected servers,
+    which any task can do concurrently.
+    """
+
+    def __init__(self, names: list[str], research_cache: ResearchCache | None = None):
+        self.names = names
+        self.research_cache = research_cache
+        self._servers: dict[str, MCPServer] = {}
+        self._cached: dict[int, CachingMCPServer] = {}
+        self._owners: dict[str, tuple[asyncio.Task, asyncio.Event]] = {}
+        self.stats = {"starts": 0, "restarts": 0, "failed_checks": 0}
+
+    @staticmethod
+    def _key(params: dict) -> str:
+        return json.dumps(params, sort_keys=True)
+
+    def _all_params(self) -> dict[str, dict]:
+        params = list(trader_mcp_server_params)
+        for name in self.names:
+            params.extend(researcher_mcp_server_params(name))
+        return {self._key(server_params): server_params for server_params in params}
+
+    @staticmethod
+    async def _own(server: MCPServer, ready: asyncio.Future, stop: asyncio.Event) -> None:
+        try:
+            await server.connect()
+        except Exception as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+        try:
+            await stop.wait()
+        finally:
+            await server.cleanup()
+
+    async def _stop(self, key: str) -> None:
+        task, stop = self._owners.pop(key)
+        stop.set()
+        await asyncio.wait([task], timeout=10)
+        if not task.done():
+            task.cancel()
+
+    async def _start(self, key: str, params: dict) -> None:
+        server = self._servers.get(key)
+        if server is None:
+            server = self._servers[key] = create_mcp_server(
+                params, cache_tools_list=True, client_session_timeout_seconds=CLIENT_SESSION_TIMEOUT_SECONDS
+            )
+        else:
+            self.stats["restarts"] += 1
+            server.invalidate_tools_cache()
+        if key in self._owners:
+            await self._stop(key)
+        ready, stop = asyncio.get_running_loop().create_future(), asyncio.Event()
+        self._owners[key] = (asyncio.create_task(self._own(server, ready, stop)), stop)
+        try:
+            await ready
+            self.stats["starts"] += 1
+        except Exception as e:
+            print(f"Warning: could not start MCP server {server.name}: {e}")
+            write_log("mcp", "warning", f"Could not start MCP server {server.name}: {e}")
+
+    def _is_running(self, key: str) -> bool:
+        owner = self._owners.get(key)
+        return owner is not None and not owner[0].done() and self._servers[key].session is not None
+
+    async def _is_healthy(self, key: str) -> bool:
+        if not self._is_running(key):
+            return False
+        try:
+            await asyncio.wait_for(self._servers[key].session.send_ping(), HEALTH_CHECK_TIMEOUT_SECONDS)
+            return True
+        except Exception:
+            self.stats["failed_checks"] += 1
+            return False
+
+    async def check(self) -> None:
+        """Start any servers not yet running and restart any that don't answer a ping; call between cycles."""
+        params = self._all_params()
+        healthy = await asyncio.gather(*(self._is_healthy(key) for key in params))
+        await asyncio.gather(*(
+            self._start(key, server_params) for (key, server_params), ok in zip(params.items(), healthy) if not ok
+        ))
+
+    def _connected(self, all_params: list[dict], name: str) -> list[MCPServer]:
+        """The connected servers for these params; raises MCPServerUnavailable if any of them isn't running."""
+        keys = [self._key(params) for params in all_params]
+        missing = [self._servers[key].name if key in self._servers else key for key in keys if not self._is_running(key)]
+        if missing:
+            message = f"MCP servers not running: {', '.join(missing)}"
+            print(f"Warning: skipping {name}'s run: {message}")
+            write_log(name, "warning", f"Skipping this run: {message}")
+            raise MCPServerUnavailable(message)
+        return [self._servers[key] for key in keys]
+
+    def _through_cache(self, servers: list[MCPServer]) -> list[MCPServer]:
+        """Route the researcher's servers through the shared research cache, if there is one."""
+        if self.research_cache is None:
+            return servers
+        wrapped = []
+        for server in servers:
+            if id(server) not in self._cached:
+                self._cached[id(server)] = CachingMCPServer(server, self.research_cache)
+            wrapped.append(self._cached[id(server)])
+        return wrapped
+
+    def trader_servers(self, name: str) -> list[MCPServer]:
+        return self._connected(trader_mcp_server_params, name)
+
+    def researcher_servers(self, name: str) -> list[MCPServer]:
+        return self._through_cache(self._connected(researcher_mcp_server_params(name), name))
+
+    def shared_researcher_servers(self) -> list[MCPServer]:
+        """The researcher servers that are the same for every trader, e.g. search and fetch but not memory."""
+        per_trader = [[self._key(params) for params in researcher_mcp_server_params(name)] for name in self.names]
+        shared = [key for key in per_trader[0] if all(key in keys for keys in per_trader[1:])] if per_trader else []
+        params = self._all_params()
+        return self._through_cache(self._connected([params[key] for key in shared], "research"))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(self._stop(key) for key in list(self._owners)))
+        self._servers.clear()
@@ -0,0 +1,184 @@
+"""
+How the trading floor connects to its own FastMCP servers (accounts, push and market), chosen by MCP_TRANSPORT
+in mcp_params.py:
+
+    stdio      - each connection launches the server as a subprocess (the default)
+    http, sse  - each server runs once as a local streamable-HTTP or SSE service that every trader shares
+    inprocess  - each server is imported into this process and its tools run in worker threads
+"""
+
+import time
+import socket
+import asyncio
+import importlib
+import subprocess
+from contextlib import asynccontextmanager
+from datetime import timedelta
+import mcp
+from mcp import types, StdioServerParameters
+from mcp.client.stdio import stdio_client
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+from agents.mcp import MCPServer, MCPServerStdio, MCPServerSse, MCPServerStreamableHttp
+
+SERVER_START_TIMEOUT_SECONDS = 30
+RUN_TRANSPORTS = {"http": "streamable-http", "sse": "sse"}
+
+
+class InProcessSession:
+    """
+    The requests a ClientSession makes, answered by an MCP server module imported into this process. Each
+    request goes to the module's own MCP request handler, so tool schemas, validation and error results are
+    the same as over stdio, but the handler runs in a worker thread: the servers' tools block on SQLite and
+    HTTP, and run on the event loop they would stall every trader.
+    """
+
+    def __init__(self, module: str, read_timeout_seconds: float | None = None):
+        self.module = module
+        self.read_timeout_seconds = read_timeout_seconds
+        self._server = None
+
+    async def initialize(self) -> None:
+        module = await asyncio.to_thread(importlib.import_module, self.module)
+        self._server = module.mcp._mcp_server
+
+    def _handle(self, request):
+        # A fresh event loop per request, in the worker thread; the tools keep no state bound to a loop
+        return asyncio.run(self._server.request_handlers[type(request)](request))
+
+    async def _request(self, request):
+        try:
+            result = await asyncio.wait_for(asyncio.to_thread(self._handle, request), self.read_timeout_seconds)
+        except (McpError, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            # What the client side of a session raises when the server answers with an error
+            raise McpError(types.ErrorData(code=0, message=str(e))) from e
+        return result.root
+
+    async def send_ping(self) -> types.EmptyResult:
+        return await self._request(types.PingRequest(method="ping"))
+
+    async def list_tools(self) -> types.ListToolsResult:
+        return await self._request(types.ListToolsRequest(method="tools/list"))
+
+    async def call_tool(self, name: str, arguments: dict | None = None) -> types.CallToolResult:
+        params = types.CallToolRequestParams(name=name, arguments=arguments)
+        return await self._request(types.CallToolRequest(method="tools/call", params=params))
+
+    async def read_resource(self, uri: str) -> types.ReadResourceResult:
+        params = types.ReadResourceRequestParams(uri=uri)
+        return await self._request(types.ReadResourceRequest(method="resources/read", params=params))
+
+
+class InProcessMCPServer(MCPServer):
+    """
+    An MCP server module's FastMCP instance, served from this process: no subprocess and no interpreter
+    start, and no blocking tool code on the event loop (see InProcessSession).
+    """
+
+    def __init__(self, params: dict, cache_tools_list: bool = False, client_session_timeout_seconds: float | None = 5):
+        self.params = params
+        self.cache_tools_list = cache_tools_list
+        self.client_session_timeout_seconds = client_session_timeout_seconds
+        self.session: InProcessSession | None = None
+        self._tools_list: list[types.Tool] | None = None
+
+    @property
+    def name(self) -> str:
+        return f"inprocess: {self.params['module']}"
+
+    async def connect(self):
+        session = InProcessSession(self.params["module"], self.client_session_timeout_seconds)
+        await session.initialize()
+        self.session = session
+
+    async def cleanup(self):
+        self.session = None
+
+    def invalidate_tools_cache(self):
+        self._tools_list = None
+
+    async def list_tools(self) -> list[types.Tool]:
+        if not self.session:
+            raise RuntimeError("Server not initialized. Make sure you call `connect()` first.")
+        if self.cache_tools_list and self._tools_list is not None:
+            return self._tools_list
+        self._tools_list = (await self.session.list_tools()).tools
+        return self._tools_list
+
+    async def call_tool(self, tool_name: str, arguments: dict | None) -> types.CallToolResult:
+        if not self.session:
+            raise RuntimeError("Server not initialized. Make sure you call `connect()` first.")
+        return await self.session.call_tool(tool_name, arguments)
+
+
+def create_mcp_server(params: dict, **kwargs) -> MCPServer:
+    """Build the agents SDK server for a set of params from mcp_params, whichever transport they're for."""
+    if "module" in params:
+        return InProcessMCPServer(params, **kwargs)
+    if "url" in params:
+        server_class = MCPServerSse if params["url"].endswith("/sse") else MCPServerStreamableHttp
+        return server_class(params, **kwargs)
+    return MCPServerStdio(params, **kwargs)
+
+
+@asynccontextmanager
+async def open_client_session(params: dict, read_timeout_seconds: float | None = None):
+    """
+    An initialized MCP client session for a set of params from mcp_params, for code that talks to a server
+    directly rather than through an agent; an in-process server gets an InProcessSession instead.
+    """
+    if "module" in params:
+        session = InProcessSession(params["module"], read_timeout_seconds)
+        await session.initialize()
+        yield session
+        return
+    if "url" in params:
+        client = sse_client(params["url"]) if params["url"].endswith("/sse") else streamablehttp_client(params["url"])
+    else:
+        client = stdio_client(StdioServerParameters(**params))
+    timeout = timedelta(seconds=read_timeout_seconds) if read_timeout_seconds else None
+    async with client as streams:
+        async with mcp.ClientSession(streams[0], streams[1], read_timeout_seconds=timeout) as session:
+            await session.initialize()
+            yield session
+
+
+def _wait_for_port(host: str, port: int, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"MCP server on port {port} exited with code {process.returncode}")
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"MCP server on port {port} didn't start within {SERVER_START_TIMEOUT_SECONDS}s")
+
+
+def start_local_servers(transport: str, servers: dict[str, int], host: str, command=("uv", "run")) -> list[subprocess.Popen]:
+    """Launch each local server (script name -> port) once as an HTTP service and wait until they all accept connections."""
+    processes = [
+        subprocess.Popen([*command, f"{name}.py", RUN_TRANSPORTS[transport], str(port)])
+        for name, port in servers.items()
+    ]
+    try:
+        for process, port in zip(processes, servers.values()):
+            _wait_for_port(host, port, process)
+    except Exception:
+        stop_local_servers(processes)
+        raise
+    return processes
+
+
+def stop_local_servers(processes: list[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
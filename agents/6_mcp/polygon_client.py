@@ -0,0 +1,144 @@
+import os
+import time
+import json
+import atexit
+import hashlib
+import threading
+from typing import Any, Callable
+from concurrent.futures import Future
+from env import load_env
+from polygon import RESTClient
+from database import (
+    take_rate_limit_token,
+    claim_shared_call,
+    write_shared_call_result,
+    release_shared_call,
+    write_log,
+)
+
+load_env()
+
+polygon_api_key = os.getenv("POLYGON_API_KEY")
+polygon_plan = os.getenv("POLYGON_PLAN")
+
+# The free plan allows 5 requests a minute; the paid plans are effectively unlimited, so cap them generously
+DEFAULT_REQUESTS_PER_MINUTE = 5 if polygon_plan not in ("paid", "realtime") else 6000
+REQUESTS_PER_MINUTE = float(os.getenv("POLYGON_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE))
+MAX_RATE_LIMIT_WAIT = float(os.getenv("POLYGON_MAX_RATE_LIMIT_WAIT", "30"))
+
+# Identical calls from other processes (each MCP server is one) share a result made within this many seconds,
+# and wait up to CLAIM_TIMEOUT_SECONDS for one that another process has already started
+SHARED_CALL_WINDOW = float(os.getenv("POLYGON_SHARED_CALL_WINDOW", "5"))
+CLAIM_TIMEOUT_SECONDS = MAX_RATE_LIMIT_WAIT + 30
+CLAIM_POLL_SECONDS = 0.05
+METRICS_LOG_SECONDS = 300
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class PolygonClient:
+    """
+    A long-lived wrapper around polygon's RESTClient, whose urllib3 pool keeps connections open between calls.
+    Every upstream request takes a token from a bucket shared by all processes on the host. Identical requests
+    made concurrently within this process share a single in-flight call, and across processes they share one
+    through a claim in the shared_calls table. The counts of calls saved are written to the logs table.
+    """
+
+    def __init__(self, api_key: str, requests_per_minute: float = REQUESTS_PER_MINUTE):
+        self.client = RESTClient(api_key, num_pools=4, retries=3)
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1.0, min(requests_per_minute, 10.0))
+        self.metrics = {"upstream_calls": 0, "coalesced_calls": 0, "shared_calls": 0, "rate_limited_waits": 0}
+        self._logged = dict(self.metrics)
+        self._logged_at = time.monotonic()
+        self._inflight: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.log_metrics)
+
+    def call(self, method: str, *args, extract: Callable[[Any], Any], **kwargs):
+        """
+        Call a RESTClient method by name, e.g. call("get_snapshot_all", "stocks", tickers=["AAPL"], extract=...),
+        and return extract(result): the fields the caller needs, as JSON-serializable values, since that's what is
+        shared with other processes. extract should be a named function; its name is part of what makes two calls
+        identical.
+        """
+        key = (method, repr(args), repr(sorted(kwargs.items())), f"{extract.__module__}.{extract.__qualname__}")
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.metrics["coalesced_calls"] += 1
+        if not leader:
+            return future.result()
+        try:
+            result = self._shared_call(key, method, args, kwargs, extract)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            if time.monotonic() - self._logged_at > METRICS_LOG_SECONDS:
+                self.log_metrics()
+
+    def _shared_call(self, key: tuple, method: str, args, kwargs, extract: Callable[[Any], Any]):
+        shared_key = "polygon:" + hashlib.sha256(repr(key).encode()).hexdigest()
+        deadline = time.monotonic() + CLAIM_TIMEOUT_SECONDS
+        while True:
+            state, result = claim_shared_call(shared_key, SHARED_CALL_WINDOW, CLAIM_TIMEOUT_SECONDS)
+            if state == "result":
+                self.metrics["shared_calls"] += 1
+                return json.loads(result)
+            if state == "claimed" or time.monotonic() > deadline:
+                break
+            time.sleep(CLAIM_POLL_SECONDS)
+        try:
+            self._wait_for_token()
+            self.metrics["upstream_calls"] += 1
+            result = extract(getattr(self.client, method)(*args, **kwargs))
+        except Exception:
+            release_shared_call(shared_key)
+            raise
+        write_shared_call_result(shared_key, json.dumps(result))
+        return result
+
+    def log_metrics(self) -> None:
+        """Write the calls made and saved since the last time to the logs table, if there were any."""
+        delta = {name: count - self._logged[name] for name, count in self.metrics.items()}
+        self._logged, self._logged_at = dict(self.metrics), time.monotonic()
+        saved = delta["coalesced_calls"] + delta["shared_calls"]
+        if not delta["upstream_calls"] and not saved:
+            return
+        write_log(
+            "polygon",
+            "polygon",
+            f"Polygon: {delta['upstream_calls']} upstream calls, {saved} saved ({delta['coalesced_calls']} "
+            f"coalesced in process {os.getpid()}, {delta['shared_calls']} shared from other processes), "
+            f"{delta['rate_limited_waits']} rate limit waits",
+        )
+
+    def _wait_for_token(self) -> None:
+        deadline = time.monotonic() + MAX_RATE_LIMIT_WAIT
+        while (wait := take_rate_limit_token("polygon", self.rate, self.capacity)) > 0:
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(f"Polygon rate limit of {REQUESTS_PER_MINUTE:g} requests/minute reached")
+            self.metrics["rate_limited_waits"] += 1
+            time.sleep(wait)
+
+
+_client: PolygonClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_polygon_client() -> PolygonClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PolygonClient(polygon_api_key)
+        return _client
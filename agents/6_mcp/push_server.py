@@ -1,10 +1,10 @@
 import os
-from dotenv import load_dotenv
-import requests
+import sys
+from env import load_env
 from pydantic import BaseModel, Field
 from mcp.server.fastmcp import FastMCP
 
-load_dotenv(override=True)
+load_env()
 
 pushover_user = os.getenv("PUSHOVER_USER")
 pushover_token = os.getenv("PUSHOVER_TOKEN")
@@ -22,10 +22,15 @@ class PushModelArgs(BaseModel):
 def push(args: PushModelArgs):
     """Send a push notification with this brief message"""
     print(f"Push: {args.message}")
+    import requests  # only needed once a push is actually sent, so it stays out of server startup
+
     payload = {"user": pushover_user, "token": pushover_token, "message": args.message}
     requests.post(pushover_url, data=payload)
     return "Push notification sent"
 
 
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    # Optional arguments: a transport ("stdio", "streamable-http" or "sse") and, for HTTP, a port
+    if len(sys.argv) > 2:
+        mcp.settings.port = int(sys.argv[2])
+    mcp.run(transport=sys.argv[1] if len(sys.argv) > 1 else "stdio")
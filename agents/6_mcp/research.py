@@ -0,0 +1,77 @@
+import os
+import time
+import asyncio
+from agents import Agent, Runner, trace
+from traders import get_model
+from tracers import make_trace_id
+from templates import research_sweep_instructions, research_sweep_topics, research_sweep_message
+from database import write_log
+
+# Findings from the shared sweep are reused until they're this old
+RESEARCH_TTL_MINUTES = float(os.getenv("RESEARCH_TTL_MINUTES", "120"))
+MAX_RESEARCH_TURNS = 15
+
+
+class ResearchSweep:
+    """
+    One market-wide research pass per cycle, shared by every trader, so the traders' own researchers only follow
+    up on what's specific to their strategies. Topics are researched concurrently and each topic's findings are
+    cached for RESEARCH_TTL_MINUTES, along with how many LLM and tool calls it took to produce them.
+    """
+
+    def __init__(self, model_name: str, ttl_minutes: float = RESEARCH_TTL_MINUTES):
+        self.model_name = model_name
+        self.ttl = ttl_minutes * 60
+        self._findings: dict[str, tuple[str, float, int, int]] = {}
+
+    async def _research(self, topic: str, mcp_servers) -> tuple[str, float, int, int]:
+        # Not the traders' researcher: the sweep only has the shared search and fetch servers, not a memory server
+        researcher = Agent(
+            name="Researcher",
+            instructions=research_sweep_instructions(),
+            model=get_model(self.model_name),
+            mcp_servers=mcp_servers,
+        )
+        # Traced as "research", so its model calls are logged and accounted for apart from any trader's
+        with trace(f"Research-{topic}", trace_id=make_trace_id("research")):
+            result = await Runner.run(researcher, research_sweep_message(topic), max_turns=MAX_RESEARCH_TURNS)
+        llm_calls = len(result.raw_responses)
+        tool_calls = sum(1 for item in result.new_items if item.type == "tool_call_item")
+        return str(result.final_output), time.time(), llm_calls, tool_calls
+
+    async def run(self, mcp_servers, traders: int) -> str:
+        """
+        Refresh any stale topics and return the combined findings. Logs an estimate of the calls the sweep saved this
+        cycle, assuming each trader would otherwise have researched each topic itself with as many calls as the sweep
+        took: a fresh topic is researched once rather than once per trader, and a cached topic isn't researched at all.
+        """
+        now = time.time()
+        stale = [topic for topic in research_sweep_topics if now - self._findings.get(topic, ("", 0.0))[1] > self.ttl]
+        results = await asyncio.gather(*(self._research(topic, mcp_servers) for topic in stale), return_exceptions=True)
+        refreshed = set()
+        for topic, result in zip(stale, results):
+            if isinstance(result, Exception):
+                print(f"Shared research on {topic} failed: {result}")
+                self._findings.pop(topic, None)
+            else:
+                self._findings[topic] = result
+                refreshed.add(topic)
+
+        saved_llm_calls = saved_tool_calls = 0
+        sections = []
+        for topic in research_sweep_topics:
+            if topic not in self._findings:
+                continue
+            findings, _, llm_calls, tool_calls = self._findings[topic]
+            runs_saved = traders - 1 if topic in refreshed else traders
+            saved_llm_calls += runs_saved * llm_calls
+            saved_tool_calls += runs_saved * tool_calls
+            sections.append(f"## {topic}\n{findings}")
+        write_log(
+            "research",
+            "research",
+            f"Shared research on {len(sections)} topics ({len(refreshed)} refreshed) saved an estimated "
+            f"{saved_llm_calls} LLM calls and {saved_tool_calls} search/fetch calls "
+            f"(if each of {traders} traders had researched every topic itself)",
+        )
+        return "\n\n".join(sections)
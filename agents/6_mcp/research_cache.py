@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from agents.mcp import MCPServer
+from mcp.types import CallToolResult
+from database import write_log
+
+# How long results stay fresh; once stale, a page is fetched again and a search re-run
+FETCH_TTL_SECONDS = float(os.getenv("RESEARCH_CACHE_FETCH_TTL_SECONDS", "3600"))
+SEARCH_TTL_SECONDS = float(os.getenv("RESEARCH_CACHE_SEARCH_TTL_SECONDS", "900"))
+MAX_BYTES = int(float(os.getenv("RESEARCH_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+# The tools worth caching on the researcher's fetch and Brave search servers, with their time to live
+CACHEABLE_TOOLS = {
+    "fetch": FETCH_TTL_SECONDS,
+    "brave_web_search": SEARCH_TTL_SECONDS,
+    "brave_local_search": SEARCH_TTL_SECONDS,
+}
+TRACKING_PARAMETERS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+
+
+def normalize_url(url: str) -> str:
+    """Lowercase the scheme and host, drop default ports, fragments and tracking parameters, and sort the query."""
+    parts = urlsplit(url.strip())
+    scheme, host = parts.scheme.lower(), (parts.hostname or "").lower()
+    port = f":{parts.port}" if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)) else ""
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMETERS)
+    )
+    return urlunsplit((scheme, host + port, parts.path or "/", urlencode(query), ""))
+
+
+def cache_key(tool_name: str, arguments: dict | None) -> str:
+    normalized = {}
+    for name, value in (arguments or {}).items():
+        if name == "url" and isinstance(value, str):
+            value = normalize_url(value)
+        elif name == "query" and isinstance(value, str):
+            value = " ".join(value.casefold().split())
+        normalized[name] = value
+    return tool_name + ":" + json.dumps(normalized, sort_keys=True)
+
+
+class CacheEntry:
+    def __init__(self, digest: str, ttl: float):
+        self.digest = digest
+        self.expires_at = time.time() + ttl
+
+
+class ResearchCache:
+    """
+    Tool results shared by every trader's researcher, keyed by tool and normalized arguments. Results are stored
+    once per sha256 of their content, so the same page reached through different URLs or arguments is only held
+    once, and the store is evicted least recently used first to stay under max_bytes. Identical calls made
+    concurrently share one call to the server.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._contents: dict[str, tuple[CallToolResult, int, int]] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        self._logged = dict(self.stats)
+
+    def _store(self, key: str, result: CallToolResult, ttl: float) -> CacheEntry:
+        content = json.dumps([block.model_dump(mode="json") for block in result.content], sort_keys=True)
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        if key in self._entries:
+            self._release(self._entries.pop(key))
+        stored, size, refs = self._contents.get(digest, (result, len(content), 0))
+        if not refs:
+            self.size += size
+        self._contents[digest] = (stored, size, refs + 1)
+        entry = self._entries[key] = CacheEntry(digest, ttl)
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._release(evicted)
+            self.stats["evictions"] += 1
+        return entry
+
+    def _release(self, entry: CacheEntry) -> None:
+        result, size, refs = self._contents[entry.digest]
+        if refs > 1:
+            self._contents[entry.digest] = (result, size, refs - 1)
+        else:
+            del self._contents[entry.digest]
+            self.size -= size
+
+    async def call_tool(self, server: MCPServer, tool_name: str, arguments: dict | None) -> CallToolResult:
+        ttl = CACHEABLE_TOOLS.get(tool_name)
+        if ttl is None:
+            return await server.call_tool(tool_name, arguments)
+        key = cache_key(tool_name, arguments)
+        entry = self._entries.get(key)
+        if entry and time.time() < entry.expires_at:
+            self.stats["hits"] += 1
+            self._entries.move_to_end(key)
+            return self._contents[entry.digest][0]
+        if key in self._inflight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self._inflight[key])
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            self.stats["misses"] += 1
+            result = await server.call_tool(tool_name, arguments)
+            if not result.isError:
+                self._store(key, result, ttl)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved, in case nobody else was waiting
+            raise
+        finally:
+            del self._inflight[key]
+
+    def log_stats(self) -> None:
+        """Write the hit rate since the last call to the logs table."""
+        delta = {name: count - self._logged[name] for name, count in self.stats.items()}
+        self._logged = dict(self.stats)
+        served = delta["hits"] + delta["coalesced"]
+        calls = served + delta["misses"]
+        if not calls:
+            return
+        write_log(
+            "research",
+            "cache",
+            f"Research cache hit rate {served / calls:.0%} ({served} of {calls} calls: {delta['hits']} fresh, "
+            f"{delta['coalesced']} coalesced); {len(self._entries)} entries, {self.size / 1024 / 1024:.1f} MB, {delta['evictions']} evicted",
+        )
+
+
+class CachingMCPServer(MCPServer):
+    """
+    A researcher's view of a fetch or search server that answers from the shared ResearchCache when it can.
+    The wrapped server's connection is managed by whoever started it; this just forwards tools and calls.
+    """
+
+    def __init__(self, server: MCPServer, cache: ResearchCache):
+        self.server = server
+        self.cache = cache
+
+    async def connect(self):
+        pass
+
+    @property
+    def name(self) -> str:
+        return f"cached: {self.server.name}"
+
+    async def cleanup(self):
+        pass
+
+    async def list_tools(self):
+        return await self.server.list_tools()
+
+    async def call_tool(self, tool_name: str, arguments: dict | None) -> CallToolResult:
+        return await self.cache.call_tool(self.server, tool_name, arguments)
@@ -0,0 +1,139 @@
+import os
+import math
+import time
+import asyncio
+from database import write_log
+from traders import Trader, get_provider
+from mcp_supervisor import MCPServerUnavailable
+
+# Per provider: how many traders may run at once, and how many runs may start per minute (with a burst of one
+# per concurrent slot). Everything else goes through OpenAI's limits.
+PROVIDER_LIMITS = {
+    "openai": (4, 20.0),
+    "deepseek": (2, 6.0),
+    "gemini": (2, 4.0),
+    "grok": (2, 6.0),
+    "openrouter": (2, 6.0),
+}
+
+# A cycle should finish within this fraction of RUN_EVERY_N_MINUTES, and no trader may run longer than the deadline
+CYCLE_BUDGET_FRACTION = 0.9
+TRADER_DEADLINE_SECONDS = float(os.getenv("TRADER_DEADLINE_SECONDS", "900"))
+MAX_STAGGER_SECONDS = 30.0
+DEFAULT_RUN_SECONDS = 120.0
+LATENCY_SMOOTHING = 0.3
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: float):
+        self.rate = per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def take(self, deadline: float) -> bool:
+        """Wait for a token; returns False without waiting if one won't be available before the deadline."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+                if now + wait >= deadline:
+                    return False
+                await asyncio.sleep(wait)
+
+
+class ProviderLimiter:
+    def __init__(self, concurrency: int, per_minute: float):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(per_minute, concurrency)
+
+
+class Scheduler:
+    """
+    Runs a cycle of traders so that it finishes within the cycle's time budget, without tripping provider limits.
+
+    Each model provider gets its own concurrency limit and token bucket, so a slow or rate limiting provider only
+    holds up its own traders. Starts are staggered within each provider, spreading them over whatever slack the
+    budget leaves given each trader's smoothed run time from earlier cycles: the slower the runs, the tighter the
+    stagger. Every run is cut off at its deadline, which is the earlier of TRADER_DEADLINE_SECONDS and the end of
+    the budget. A failed run isn't repeated, since it may already have traded: rate limits and connection errors
+    are retried by the model clients, one model call at a time (see MODEL_MAX_RETRIES in traders.py).
+    """
+
+    def __init__(self, cycle_seconds: float, budget_fraction: float = CYCLE_BUDGET_FRACTION):
+        self.budget = cycle_seconds * budget_fraction
+        self.latency: dict[str, float] = {}
+        self._limiters: dict[str, ProviderLimiter] = {}
+
+    def _limiter(self, provider: str) -> ProviderLimiter:
+        if provider not in self._limiters:
+            self._limiters[provider] = ProviderLimiter(*PROVIDER_LIMITS.get(provider, PROVIDER_LIMITS["openai"]))
+        return self._limiters[provider]
+
+    def estimate(self, trader: Trader) -> float:
+        return self.latency.get(trader.name, DEFAULT_RUN_SECONDS)
+
+    def plan(self, traders: list[Trader]) -> dict[str, float]:
+        """Start offsets in seconds for each trader, from the estimated makespan of each provider's traders."""
+        by_provider: dict[str, list[Trader]] = {}
+        for trader in traders:
+            by_provider.setdefault(get_provider(trader.model_name), []).append(trader)
+        offsets = {}
+        for provider, group in by_provider.items():
+            lanes = self._limiter(provider).concurrency
+            makespan = math.ceil(len(group) / lanes) * max(self.estimate(trader) for trader in group)
+            stagger = min(MAX_STAGGER_SECONDS, max(0.0, self.budget - makespan) / len(group))
+            for i, trader in enumerate(group):
+                offsets[trader.name] = i * stagger
+            if makespan > self.budget:
+                write_log(
+                    "scheduler", "scheduler",
+                    f"{provider} traders need about {makespan:.0f}s but the cycle budget is {self.budget:.0f}s",
+                )
+        return offsets
+
+    def _observe(self, trader: Trader, seconds: float) -> None:
+        previous = self.latency.get(trader.name)
+        self.latency[trader.name] = (
+            seconds if previous is None else LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * previous
+        )
+
+    async def _run(self, trader: Trader, offset: float, deadline: float) -> None:
+        limiter = self._limiter(get_provider(trader.model_name))
+        await asyncio.sleep(offset)
+        try:
+            async with limiter.semaphore:
+                remaining = min(deadline - time.monotonic(), TRADER_DEADLINE_SECONDS)
+                if remaining <= 0 or not await limiter.bucket.take(deadline):
+                    write_log(trader.name, "scheduler", "Skipped this cycle: no time left in the cycle budget")
+                    return
+                start = time.monotonic()
+                try:
+                    await asyncio.wait_for(trader.run_with_trace(), remaining)
+                    self._observe(trader, time.monotonic() - start)
+                except asyncio.TimeoutError:
+                    self._observe(trader, time.monotonic() - start)
+                    write_log(trader.name, "scheduler", f"Stopped at the {remaining:.0f}s deadline")
+                except MCPServerUnavailable:
+                    pass  # already logged by the supervisor
+                except Exception as e:
+                    print(f"Error running trader {trader.name}: {e}")
+        finally:
+            trader.do_trade = not trader.do_trade
+
+    async def run_cycle(self, traders: list[Trader]) -> None:
+        offsets = self.plan(traders)
+        deadline = time.monotonic() + self.budget
+        start = time.monotonic()
+        await asyncio.gather(*(self._run(trader, offsets[trader.name], deadline) for trader in traders))
+        write_log(
+            "scheduler", "scheduler",
+            f"Cycle of {len(traders)} traders took {time.monotonic() - start:.0f}s of a {self.budget:.0f}s budget",
+        )
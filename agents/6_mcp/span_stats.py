@@ -0,0 +1,129 @@
+"""
+Where the time goes in a trading cycle: latency percentiles for every model, tool and MCP server, and for
+each trader's runs as a whole, from the spans the LogTracer records. Usage:
+
+    uv run span_stats.py [hours]
+"""
+
+import sys
+import math
+import time
+from database import read_spans
+
+# Histogram buckets grow by this factor, so a reported percentile is within about 2.5% of the true value
+BUCKET_GROWTH = 1.05
+PERCENTILES = (0.5, 0.95, 0.99)
+DEFAULT_HOURS = 24
+# The window is kept as this many periods, so it moves forward a period at a time as the oldest is dropped
+WINDOW_PERIODS = 24
+COLUMNS = ["Dimension", "Key", "Calls", "Errors", "p50 ms", "p95 ms", "p99 ms", "Max ms", "Total s"]
+
+
+class LatencyHistogram:
+    """A streaming histogram with log-spaced buckets: constant memory however many durations are added."""
+
+    def __init__(self):
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float, error: bool = False) -> None:
+        bucket = math.ceil(math.log(ms, BUCKET_GROWTH)) if ms > 1 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.errors += error
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.max, BUCKET_GROWTH**bucket)
+        return self.max
+
+
+class SpanStats:
+    """
+    Latency histograms keyed by (dimension, key), where the dimension is a model, tool or MCP server, over the last
+    `hours`. Spans are kept in WINDOW_PERIODS histograms by when they started, and each update() drops the periods
+    that have left the window, so it keeps moving and memory stays bounded however long the stats are kept. Each
+    update() only reads the spans recorded since the last one, so it can be called as often as needed.
+    """
+
+    def __init__(self, hours: float = DEFAULT_HOURS):
+        self.hours = hours
+        self.period_seconds = hours * 3600 / WINDOW_PERIODS
+        self._periods: dict[int, dict[tuple[str, str], LatencyHistogram]] = {}
+        self.last_id = 0
+
+    def _add(self, period: dict, dimension: str, key: str | None, ms: float, error: bool) -> None:
+        if key:
+            period.setdefault((dimension, key), LatencyHistogram()).add(ms, error)
+
+    def update(self) -> None:
+        oldest = math.floor((time.time() - self.hours * 3600) / self.period_seconds)
+        for index in [index for index in self._periods if index < oldest]:
+            del self._periods[index]
+        for id, started_at, type, name, server, model, ms, error in read_spans(self.last_id, oldest * self.period_seconds):
+            self.last_id = id
+            period = self._periods.setdefault(int(started_at // self.period_seconds), {})
+            error = error is not None
+            if type in ("generation", "response"):
+                self._add(period, "model", model, ms, error)
+            elif type == "function":
+                self._add(period, "tool", name, ms, error)
+                self._add(period, "server", server, ms, error)
+            elif type == "mcp_tools":
+                self._add(period, "server", f"{server} (list tools)", ms, error)
+            elif type == "trace":
+                self._add(period, "run", name, ms, error)
+
+    @property
+    def histograms(self) -> dict[tuple[str, str], LatencyHistogram]:
+        """The histograms for the whole window, each period's merged together."""
+        merged: dict[tuple[str, str], LatencyHistogram] = {}
+        for period in self._periods.values():
+            for key, histogram in period.items():
+                merged.setdefault(key, LatencyHistogram()).merge(histogram)
+        return merged
+
+    def rows(self) -> list[list]:
+        """One row per (dimension, key), the biggest total time first: the best places to optimize."""
+        rows = [
+            [dimension, key, h.count, h.errors, *(round(h.percentile(q)) for q in PERCENTILES), round(h.max),
+             round(h.total / 1000, 1)]
+            for (dimension, key), h in self.histograms.items()
+        ]
+        return sorted(rows, key=lambda row: row[-1], reverse=True)
+
+    def report(self) -> str:
+        rows = [COLUMNS] + [[str(value) for value in row] for row in self.rows()]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+        return "\n".join(
+            "  ".join(value.ljust(width) if i < 2 else value.rjust(width) for i, (value, width) in enumerate(zip(row, widths)))
+            for row in rows
+        )
+
+
+if __name__ == "__main__":
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_HOURS
+    stats = SpanStats(hours)
+    stats.update()
+    if stats.histograms:
+        print(f"Span latency over the last {hours:g} hours\n")
+        print(stats.report())
+    else:
+        print(f"No spans recorded in the last {hours:g} hours")
@@ -1,9 +1,26 @@
 from agents import TracingProcessor, Trace, Span
-from database import write_log
+from database import write_logs, write_spans, write_token_usage
+from usage import token_cost
+from collections import deque
+from datetime import date
+import os
+import time
+import zlib
+import atexit
 import secrets
 import string
+import threading
 
-ALPHANUM = string.ascii_lowercase + string.digits 
+ALPHANUM = string.ascii_lowercase + string.digits
+
+# Span events are buffered and written to the logs and spans tables in batches by a background thread, every
+# LOG_FLUSH_SECONDS or as soon as LOG_BATCH_SIZE events are waiting, whichever comes first.
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "1.0"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+# Beyond this many unwritten events (e.g. the DB is locked for a long time) new events are dropped
+LOG_MAX_QUEUE = int(os.getenv("LOG_MAX_QUEUE", "20000"))
+# The fraction of traces whose spans are logged; the trace itself and any span with an error are always logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
 
 def make_trace_id(tag: str) -> str:
     """
@@ -15,7 +32,50 @@ def make_trace_id(tag: str) -> str:
     random_suffix = ''.join(secrets.choice(ALPHANUM) for _ in range(pad_len))
     return f"trace_{tag}{random_suffix}"
 
+def span_dimensions(span) -> tuple[str, str | None, str | None, str | None]:
+    """The (type, name, server, model) a finished span is reported under."""
+    data = span.span_data
+    if data is None:
+        return "span", None, None, None
+    name = getattr(data, "name", None)
+    server = getattr(data, "server", None)
+    model = getattr(data, "model", None)
+    if data.type == "function" and data.mcp_data:
+        server = data.mcp_data.get("server")
+    elif data.type == "response" and data.response is not None:
+        model = data.response.model
+    return data.type, name, server, model
+
 class LogTracer(TracingProcessor):
+    """
+    Logs traces and spans for the traders to the logs table, and records each finished span with its duration
+    in the spans table. The hooks run on the event loop that drives the traders, so they only queue the event;
+    a background thread writes the queues out in batches.
+    """
+
+    def __init__(
+        self,
+        flush_seconds: float = LOG_FLUSH_SECONDS,
+        batch_size: int = LOG_BATCH_SIZE,
+        sample_rate: float = LOG_SAMPLE_RATE,
+        max_queue: int = LOG_MAX_QUEUE,
+    ):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.sample_rate = sample_rate
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._queue = deque()
+        self._spans = deque()
+        self._usage = deque()
+        # When each open trace and span started, by id, so the end event can be paired with it
+        self._started: dict[str, tuple[str, float]] = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="log-tracer", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
 
     def get_name(self, trace_or_span: Trace | Span) -> str | None:
         trace_id = trace_or_span.trace_id
@@ -25,51 +85,118 @@ class LogTracer(TracingProcessor):
         else:
             return None
 
+    def is_sampled(self, trace_id: str) -> bool:
+        # Decided by the trace id, so a trace's spans are either all logged or not at all
+        return self.sample_rate >= 1 or zlib.crc32(trace_id.encode()) < self.sample_rate * 2**32
+
+    def _log(self, name: str, type: str, message: str) -> None:
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append((name, time.time(), type, message))
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def _record_span(self, name: str, trace_id: str, dimensions: tuple, started_at: float, error) -> None:
+        if len(self._spans) >= self.max_queue:
+            self.dropped += 1
+            return
+        duration_ms = (time.time() - started_at) * 1000
+        error = error.get("message") if isinstance(error, dict) else error
+        self._spans.append((name, trace_id, *dimensions, started_at, duration_ms, error))
+        if len(self._spans) >= self.batch_size:
+            self._wake.set()
+
+    def _record_usage(self, name: str, span) -> None:
+        # Every model call goes into the token ledger, sampled or not
+        data = span.span_data
+        if data.type == "generation" and data.usage:
+            model, input_tokens, output_tokens = data.model, data.usage["input_tokens"], data.usage["output_tokens"]
+        elif data.type == "response" and data.response is not None and data.response.usage:
+            usage = data.response.usage
+            model, input_tokens, output_tokens = data.response.model, usage.input_tokens, usage.output_tokens
+        else:
+            return
+        model = model or "unknown"
+        cost = token_cost(model, input_tokens, output_tokens)
+        self._usage.append((name, date.today().isoformat(), span.trace_id, model, input_tokens, output_tokens, cost))
+
+    def _span_message(self, event: str, span) -> str:
+        message = event
+        if span.span_data:
+            if span.span_data.type:
+                message += f" {span.span_data.type}"
+            if hasattr(span.span_data, "name") and span.span_data.name:
+                message += f" {span.span_data.name}"
+            if hasattr(span.span_data, "server") and span.span_data.server:
+                message += f" {span.span_data.server}"
+        if span.error:
+            message += f" {span.error}"
+        return message
+
+    def _on_span(self, event: str, span) -> bool:
+        name = self.get_name(span)
+        if name and (span.error or self.is_sampled(span.trace_id)):
+            type = span.span_data.type if span.span_data else "span"
+            self._log(name, type, self._span_message(event, span))
+            return True
+        return False
+
     def on_trace_start(self, trace) -> None:
         name = self.get_name(trace)
         if name:
-            write_log(name, "trace", f"Started: {trace.name}")
+            self._started[trace.trace_id] = (trace.trace_id, time.time())
+            self._log(name, "trace", f"Started: {trace.name}")
 
     def on_trace_end(self, trace) -> None:
         name = self.get_name(trace)
         if name:
-            write_log(name, "trace", f"Ended: {trace.name}")
+            self._log(name, "trace", f"Ended: {trace.name}")
+            _, started_at = self._started.pop(trace.trace_id, (None, None))
+            if started_at is not None:
+                self._record_span(name, trace.trace_id, ("trace", trace.name, None, None), started_at, None)
+        # Forget any spans of this trace that never ended, e.g. because the run was cancelled
+        for id in [id for id, (trace_id, _) in self._started.items() if trace_id == trace.trace_id]:
+            del self._started[id]
 
     def on_span_start(self, span) -> None:
-        name = self.get_name(span)
-        type = span.span_data.type if span.span_data else "span"
-        if name:
-            message = "Started"
-            if span.span_data:
-                if span.span_data.type:
-                    message += f" {span.span_data.type}"
-                if hasattr(span.span_data, "name") and span.span_data.name:
-                    message += f" {span.span_data.name}"
-                if hasattr(span.span_data, "server") and span.span_data.server:
-                    message += f" {span.span_data.server}"
-            if span.error:
-                message += f" {span.error}"
-            write_log(name, type, message)
+        if self.get_name(span):
+            self._started[span.span_id] = (span.trace_id, time.time())
+        self._on_span("Started", span)
 
     def on_span_end(self, span) -> None:
-        name = self.get_name(span)
-        type = span.span_data.type if span.span_data else "span"
-        if name:
-            message = "Ended"
-            if span.span_data:
-                if span.span_data.type:
-                    
-                    message += f" {span.span_data.type}"
-                if hasattr(span.span_data, "name") and span.span_data.name:
-                    message += f" {span.span_data.name}"
-                if hasattr(span.span_data, "server") and span.span_data.server:
-                    message += f" {span.span_data.server}"
-            if span.error:
-                message += f" {span.error}"
-            write_log(name, type, message)
+        _, started_at = self._started.pop(span.span_id, (None, None))
+        if span.span_data and self.get_name(span):
+            self._record_usage(self.get_name(span), span)
+        if self._on_span("Ended", span) and started_at is not None:
+            self._record_span(self.get_name(span), span.trace_id, span_dimensions(span), started_at, span.error)
+
+    def _flush(self) -> None:
+        with self._flush_lock:
+            for queue, write in ((self._queue, write_logs), (self._spans, write_spans), (self._usage, write_token_usage)):
+                while queue:
+                    batch = [queue.popleft() for _ in range(min(len(queue), self.batch_size))]
+                    try:
+                        write(batch)
+                    except Exception as e:
+                        print(f"Failed to write {len(batch)} log entries: {e}")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self._flush()
 
     def force_flush(self) -> None:
-        pass
+        """Write out everything queued so far before returning."""
+        self._flush()
 
     def shutdown(self) -> None:
-        pass
\ No newline at end of file
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join()
+        self._flush()
+        if self.dropped:
+            print(f"LogTracer dropped {self.dropped} log entries because the queue was full")
@@ -1,12 +1,12 @@
 from contextlib import AsyncExitStack
-from accounts_client import read_accounts_resource, read_strategy_resource
+from accounts_client import read_account_summary_resource, read_strategy_resource
 from tracers import make_trace_id
-from agents import Agent, Tool, Runner, OpenAIChatCompletionsModel, trace
+from usage import budget_mode
+from agents import Agent, Tool, Runner, OpenAIChatCompletionsModel, trace, set_default_openai_client
 from openai import AsyncOpenAI
-from dotenv import load_dotenv
+from env import load_env
 import os
-import json
-from agents.mcp import MCPServerStdio
+from mcp_transports import create_mcp_server
 from templates import (
     researcher_instructions,
     trader_instructions,
@@ -16,7 +16,7 @@ from templates import (
 )
 from mcp_params import trader_mcp_server_params, researcher_mcp_server_params
 
-load_dotenv(override=True)
+load_env()
 
 deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
 google_api_key = os.getenv("GOOGLE_API_KEY")
@@ -29,24 +29,47 @@ GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
 MAX_TURNS = 30
+# Model calls that hit a rate limit, a connection error or a server error are retried by the client itself, with
+# jittered exponential backoff that honours Retry-After. Only the failed call is repeated, never the tool calls
+# an agent run has already made.
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "5"))
 
-openrouter_client = AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=openrouter_api_key)
-deepseek_client = AsyncOpenAI(base_url=DEEPSEEK_BASE_URL, api_key=deepseek_api_key)
-grok_client = AsyncOpenAI(base_url=GROK_BASE_URL, api_key=grok_api_key)
-gemini_client = AsyncOpenAI(base_url=GEMINI_BASE_URL, api_key=google_api_key)
+openai_client = AsyncOpenAI(max_retries=MODEL_MAX_RETRIES)
+openrouter_client = AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=openrouter_api_key, max_retries=MODEL_MAX_RETRIES)
+deepseek_client = AsyncOpenAI(base_url=DEEPSEEK_BASE_URL, api_key=deepseek_api_key, max_retries=MODEL_MAX_RETRIES)
+grok_client = AsyncOpenAI(base_url=GROK_BASE_URL, api_key=grok_api_key, max_retries=MODEL_MAX_RETRIES)
+gemini_client = AsyncOpenAI(base_url=GEMINI_BASE_URL, api_key=google_api_key, max_retries=MODEL_MAX_RETRIES)
 
+# OpenAI models are given by name, so they go through the SDK's default client
+set_default_openai_client(openai_client, use_for_tracing=False)
 
-def get_model(model_name: str):
+
+provider_clients = {
+    "openrouter": openrouter_client,
+    "deepseek": deepseek_client,
+    "grok": grok_client,
+    "gemini": gemini_client,
+}
+
+
+def get_provider(model_name: str) -> str:
     if "/" in model_name:
-        return OpenAIChatCompletionsModel(model=model_name, openai_client=openrouter_client)
+        return "openrouter"
     elif "deepseek" in model_name:
-        return OpenAIChatCompletionsModel(model=model_name, openai_client=deepseek_client)
+        return "deepseek"
     elif "grok" in model_name:
-        return OpenAIChatCompletionsModel(model=model_name, openai_client=grok_client)
+        return "grok"
     elif "gemini" in model_name:
-        return OpenAIChatCompletionsModel(model=model_name, openai_client=gemini_client)
+        return "gemini"
     else:
+        return "openai"
+
+
+def get_model(model_name: str):
+    provider = get_provider(model_name)
+    if provider == "openai":
         return model_name
+    return OpenAIChatCompletionsModel(model=model_name, openai_client=provider_clients[provider])
 
 
 async def get_researcher(mcp_servers, model_name) -> Agent:
@@ -65,12 +88,14 @@ async def get_researcher_tool(mcp_servers, model_name) -> Tool:
 
 
 class Trader:
-    def __init__(self, name: str, lastname="Trader", model_name="gpt-4o-mini"):
+    def __init__(self, name: str, lastname="Trader", model_name="gpt-4o-mini", mcp_supervisor=None):
         self.name = name
         self.lastname = lastname
         self.agent = None
         self.model_name = model_name
         self.do_trade = True
+        self.mcp_supervisor = mcp_supervisor
+        self.shared_research = ""
 
     async def create_agent(self, trader_mcp_servers, researcher_mcp_servers) -> Agent:
         tool = await get_researcher_tool(researcher_mcp_servers, self.model_name)
@@ -84,48 +109,48 @@ class Trader:
         return self.agent
 
     async def get_account_report(self) -> str:
-        account = await read_accounts_resource(self.name)
-        account_json = json.loads(account)
-        account_json.pop("portfolio_value_time_series", None)
-        return json.dumps(account_json)
+        return await read_account_summary_resource(self.name)
 
-    async def run_agent(self, trader_mcp_servers, researcher_mcp_servers):
+    async def run_agent(self, trader_mcp_servers, researcher_mcp_servers, trade: bool):
         self.agent = await self.create_agent(trader_mcp_servers, researcher_mcp_servers)
         account = await self.get_account_report()
         strategy = await read_strategy_resource(self.name)
         message = (
-            trade_message(self.name, strategy, account)
-            if self.do_trade
-            else rebalance_message(self.name, strategy, account)
+            trade_message(self.name, strategy, account, self.shared_research)
+            if trade
+            else rebalance_message(self.name, strategy, account, self.shared_research)
         )
         await Runner.run(self.agent, message, max_turns=MAX_TURNS)
 
-    async def run_with_mcp_servers(self):
+    async def run_with_mcp_servers(self, trade: bool):
+        if self.mcp_supervisor:
+            # The trading floor keeps these servers running between cycles
+            await self.run_agent(
+                self.mcp_supervisor.trader_servers(self.name), self.mcp_supervisor.researcher_servers(self.name), trade
+            )
+            return
         async with AsyncExitStack() as stack:
             trader_mcp_servers = [
                 await stack.enter_async_context(
-                    MCPServerStdio(params, client_session_timeout_seconds=120)
+                    create_mcp_server(params, client_session_timeout_seconds=120)
                 )
                 for params in trader_mcp_server_params
             ]
             async with AsyncExitStack() as stack:
                 researcher_mcp_servers = [
                     await stack.enter_async_context(
-                        MCPServerStdio(params, client_session_timeout_seconds=120)
+                        create_mcp_server(params, client_session_timeout_seconds=120)
                     )
                     for params in researcher_mcp_server_params(self.name)
                 ]
-                await self.run_agent(trader_mcp_servers, researcher_mcp_servers)
+                await self.run_agent(trader_mcp_servers, researcher_mcp_servers, trade)
 
     async def run_with_trace(self):
-        trace_name = f"{self.name}-trading" if self.do_trade else f"{self.name}-rebalancing"
+        mode = budget_mode(self.name)
+        if mode == "skip":
+            return
+        trade = self.do_trade and mode == "trade"
+        trace_name = f"{self.name}-trading" if trade else f"{self.name}-rebalancing"
         trace_id = make_trace_id(f"{self.name.lower()}")
         with trace(trace_name, trace_id=trace_id):
-            await self.run_with_mcp_servers()
-
-    async def run(self):
-        try:
-            await self.run_with_trace()
-        except Exception as e:
-            print(f"Error running trader {self.name}: {e}")
-        self.do_trade = not self.do_trade
+            await self.run_with_mcp_servers(trade)
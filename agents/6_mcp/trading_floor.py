@@ -1,19 +1,29 @@
 from traders import Trader
 from typing import List
 import asyncio
+import time
 from tracers import LogTracer
 from agents import add_trace_processor
-from market import is_market_open
-from dotenv import load_dotenv
+from market import is_market_open, warm_price_cache
+from accounts import Account
+from accounts_client import close_accounts_sessions
+from mcp_supervisor import MCPSupervisor, MCPServerUnavailable
+from research import ResearchSweep
+from research_cache import ResearchCache
+from scheduler import Scheduler
+from mcp_params import MCP_TRANSPORT, MCP_HTTP_HOST, local_mcp_servers, local_server_params, trader_mcp_server_params
+from mcp_transports import start_local_servers, stop_local_servers
+from env import load_env
 import os
 
-load_dotenv(override=True)
+load_env()
 
 RUN_EVERY_N_MINUTES = int(os.getenv("RUN_EVERY_N_MINUTES", "60"))
 RUN_EVEN_WHEN_MARKET_IS_CLOSED = (
     os.getenv("RUN_EVEN_WHEN_MARKET_IS_CLOSED", "false").strip().lower() == "true"
 )
 USE_MANY_MODELS = os.getenv("USE_MANY_MODELS", "false").strip().lower() == "true"
+SHARED_RESEARCH = os.getenv("SHARED_RESEARCH", "false").strip().lower() == "true"
 
 names = ["Warren", "George", "Ray", "Cathie"]
 lastnames = ["Patience", "Bold", "Systematic", "Crypto"]
@@ -31,22 +41,54 @@ else:
     short_model_names = ["GPT 4o mini"] * 4
 
 
-def create_traders() -> List[Trader]:
+def create_traders(mcp_supervisor: MCPSupervisor | None = None) -> List[Trader]:
     traders = []
     for name, lastname, model_name in zip(names, lastnames, model_names):
-        traders.append(Trader(name, lastname, model_name))
+        traders.append(Trader(name, lastname, model_name, mcp_supervisor))
     return traders
 
 
 async def run_every_n_minutes():
     add_trace_processor(LogTracer())
-    traders = create_traders()
-    while True:
-        if RUN_EVEN_WHEN_MARKET_IS_CLOSED or is_market_open():
-            await asyncio.gather(*[trader.run() for trader in traders])
-        else:
-            print("Market is closed, skipping run")
-        await asyncio.sleep(RUN_EVERY_N_MINUTES * 60)
+    local_servers = []
+    if MCP_TRANSPORT in ("http", "sse"):
+        # Run each of our own MCP servers once, as a local service shared by every trader
+        servers = {
+            name: port for name, port in local_mcp_servers.items()
+            if local_server_params(name) in trader_mcp_server_params
+        }
+        local_servers = start_local_servers(MCP_TRANSPORT, servers, MCP_HTTP_HOST)
+    research_cache = ResearchCache()
+    mcp_supervisor = MCPSupervisor(names, research_cache)
+    traders = create_traders(mcp_supervisor)
+    research_sweep = ResearchSweep(model_names[0]) if SHARED_RESEARCH else None
+    scheduler = Scheduler(RUN_EVERY_N_MINUTES * 60)
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            if RUN_EVEN_WHEN_MARKET_IS_CLOSED or is_market_open():
+                await mcp_supervisor.check()
+                symbols = {symbol for name in names for symbol in Account.get(name).holdings}
+                warm_price_cache(symbols)
+                if research_sweep:
+                    try:
+                        research = await research_sweep.run(mcp_supervisor.shared_researcher_servers(), len(traders))
+                        for trader in traders:
+                            trader.shared_research = research
+                    except MCPServerUnavailable:
+                        pass  # already logged; traders keep the last findings this cycle
+                await scheduler.run_cycle(traders)
+                for name in names:
+                    Account.get(name).snapshot(min_interval=RUN_EVERY_N_MINUTES * 60 / 2)
+                research_cache.log_stats()
+            else:
+                print("Market is closed, skipping run")
+            # Cycles start every RUN_EVERY_N_MINUTES, which the scheduler keeps each cycle within
+            await asyncio.sleep(max(0.0, RUN_EVERY_N_MINUTES * 60 - (time.monotonic() - cycle_start)))
+    finally:
+        await mcp_supervisor.close()
+        await close_accounts_sessions()
+        stop_local_servers(local_servers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,69 @@
+"""
+Token and cost accounting for the traders. The LogTracer adds every model call to the token_usage ledger,
+and the budget guard here decides how much a trader may still do today. Usage:
+
+    uv run usage.py [days]
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+from database import read_tokens_used, read_token_usage, count_transactions, write_log
+
+# US dollars per million (input, output) tokens; a model matches the longest name it starts with
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4o": (2.50, 10.00),
+    "deepseek-chat": (0.27, 1.10),
+    "gemini-2.5-flash": (0.15, 0.60),
+    "grok-3-mini": (0.30, 0.50),
+}
+
+# Each trader's daily token budget; 0 means unlimited. Past REBALANCE_ONLY_FRACTION of it a trader only
+# rebalances, and once it's spent the trader sits out its cycles until tomorrow.
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+REBALANCE_ONLY_FRACTION = float(os.getenv("REBALANCE_ONLY_FRACTION", "0.8"))
+
+
+def token_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    matches = [name for name in MODEL_PRICES if model.split("/")[-1].startswith(name)]
+    if not matches:
+        return 0.0
+    input_price, output_price = MODEL_PRICES[max(matches, key=len)]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def budget_mode(name: str, budget: int = DAILY_TOKEN_BUDGET) -> str:
+    """Whether the trader may run as usual today ("trade"), only rebalance ("rebalance"), or not at all ("skip")."""
+    if not budget:
+        return "trade"
+    used = read_tokens_used(name, date.today().isoformat())
+    if used >= budget:
+        write_log(name, "budget", f"Skipping this cycle: {used:,} of {budget:,} tokens used today")
+        return "skip"
+    if used >= budget * REBALANCE_ONLY_FRACTION:
+        write_log(name, "budget", f"Rebalancing only: {used:,} of {budget:,} tokens used today")
+        return "rebalance"
+    return "trade"
+
+
+def usage_report(days: int = 1) -> str:
+    since = (date.today() - timedelta(days=days - 1)).isoformat()
+    lines = [f"{'Trader':<10}{'Model':<32}{'Runs':>6}{'Calls':>7}{'Input':>12}{'Output':>10}{'Cost':>10}{'Per trade':>11}"]
+    for trader, model, runs, requests, input_tokens, output_tokens, cost in read_token_usage(since):
+        trades = count_transactions(trader, since)
+        per_trade = f"${cost / trades:.4f}" if trades else "-"
+        lines.append(
+            f"{trader:<10}{model[:31]:<32}{runs:>6}{requests:>7}{input_tokens:>12,}{output_tokens:>10,}"
+            f"{'$' + format(cost, '.4f'):>10}{per_trade:>11}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    print(f"Token usage over the last {days} day(s)\n")
+    print(usage_report(days))